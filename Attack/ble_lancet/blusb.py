@@ -1,10 +1,62 @@
+import time
+import queue
+import array
 import usb.core
 import usb.util
 import asyncio
 import threading
 
+from . import trace
 from .interface import Interface
-from .packet import LANCET_HEADER, LANCET_MAGIC
+from .packet import LANCET_HEADER, LANCET_HEADER_STRUCT, LANCET_MAGIC
+# the longest frame is 8 + 255 bytes, the ring holds many of them
+RING_SIZE = 4096
+# bytes of the bulk transfers when frames are coalesced, e.g. 512, only once the
+# firmware is known to parse several frames from one OUT transfer
+WRITE_SIZE = None
+
+
+class FrameRing(object):
+    """
+    Preallocated receive buffer that splits the byte stream of the dongle into
+    Lancet frames. Reads are copied in once and every complete frame is
+    returned, however many arrived in one transfer.
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def feed(self, data, length):
+        if self.end + length > len(self.buffer):
+            # move the partial frame to the front, at most one frame is copied
+            pending = self.end - self.start
+            self.buffer[:pending] = self.view[self.start:self.end].tobytes()
+            self.start = 0
+            self.end = pending
+        self.view[self.end:self.end + length] = memoryview(data)[:length]
+        self.end += length
+
+    def frames(self):
+        while self.start < self.end:
+            pos = self.buffer.find(LANCET_MAGIC, self.start, self.end)
+            if pos < 0:
+                pos = self.end
+            if pos > self.start:
+                print(f'[WARNING] dropped {pos - self.start} bytes')
+                self.start = pos
+            if self.end - self.start < LANCET_HEADER.size:
+                break
+            _, _, length, _, _ = LANCET_HEADER_STRUCT.unpack_from(self.buffer, self.start)
+            frame_length = LANCET_HEADER.size + length
+            if self.end - self.start < frame_length:
+                break
+            yield self.view[self.start:self.start + frame_length].tobytes()
+            self.start += frame_length
+        if self.start == self.end:
+            self.start = self.end = 0
 
 
 class BLancetUSB(object):
@@ -12,11 +64,23 @@ class BLancetUSB(object):
     read_ep = None
     write_ep = None
     interval = 0.01
-    read_itf = Interface()
-    write_itf = Interface()
+    read_itf = Interface(name='usb read')
+    write_itf = Interface(name='usb write')
 
-    def __init__(self, idVendor, idProduct, interval=0.1):
+    def __init__(self, idVendor, idProduct, interval=0.1, read_size=None,
+                 write_size=WRITE_SIZE, write_delay=0, report_interval=None):
         self.interval = interval
+        # bytes per bulk read, defaults to one USB packet of the endpoint
+        self.read_size = read_size
+        # None writes one frame per transfer. Otherwise frames queued together are
+        # written in one transfer of up to write_size bytes, write_delay is how long
+        # to wait for more frames (0: never wait)
+        self.write_size = write_size
+        self.write_delay = write_delay
+        # print the write statistics every report_interval seconds
+        self.report_interval = report_interval
+        self.write_stats = {'transfers': 0, 'frames': 0, 'bytes': 0,
+                            'latency': 0, 'max latency': 0, 'max depth': 0}
         self.idVendor = idVendor
         self.idProduct = idProduct
 
@@ -47,8 +111,8 @@ class BLancetUSB(object):
         # start the read thread
         # self.tasks.append(asyncio.create_task(self.__read()))
         threading.Thread(target=self.__read_thread).start()
-        # start the write thread
-        self.tasks.append(asyncio.create_task(self.__write()))
+        # start the write thread, USB writes block and must not stall the event loop
+        threading.Thread(target=self.__write_thread).start()
 
     async def __wait_for_device(self, idVendor, idProduct):
         print(f"Waiting for device {idVendor:04x}:{idProduct:04x} ...")
@@ -59,35 +123,75 @@ class BLancetUSB(object):
             await asyncio.sleep(self.interval)
 
     def __read_thread(self):
-        buffer = b''
+        chunk = array.array('B', bytes(self.read_size or self.read_ep.wMaxPacketSize))
+        ring = FrameRing(RING_SIZE + len(chunk))
         while True:
-            while True:
-                try:
-                    data = self.read_ep.read(64)
+            try:
+                length = self.read_ep.read(chunk)
+            except usb.core.USBError as e:
+                if e.errno != 110:
+                    raise e
+                continue
+            ring.feed(chunk, length)
+            for frame in ring.frames():
+                # raw bytes, the listener of the lancet decides what to dissect
+                self.read_itf.put_data(frame)
+
+    def __write_thread(self):
+        pending = None
+        last_report = time.perf_counter()
+        while True:
+            # the frame that did not fit in the last transfer goes first
+            frame = pending if pending is not None else self.__take_frame(True)
+            pending = None
+            taken = time.perf_counter()
+            batch = bytearray(frame)
+            frames = 1
+            # coalesce the frames already queued, or arriving within write_delay,
+            # a frame is never split across two transfers
+            while self.write_size is not None and len(batch) + LANCET_HEADER.size <= self.write_size:
+                timeout = taken + self.write_delay - time.perf_counter()
+                frame = self.__take_frame(timeout > 0, max(timeout, 0))
+                if frame is None:
+                    break
+                if len(batch) + len(frame) > self.write_size:
+                    pending = frame
                     break
-                except usb.core.USBError as e:
-                    if e.errno != 110:
-                        raise e
-                    continue
-            buffer += data
-
-            drop_cnt = 0
-            while buffer[0] != LANCET_MAGIC:
-                buffer = buffer[1:]
-                drop_cnt += 1
-            if drop_cnt > 0:
-                print(f'[WARNING] dropped {drop_cnt} bytes')
-
-            if len(buffer) >= LANCET_HEADER.size:
-                hdr = LANCET_HEADER(buffer)
-                pkt_length = hdr.size + hdr.len
-                if len(buffer) >= pkt_length:
-                    data = buffer[:pkt_length]
-                    self.read_itf.put_data(LANCET_HEADER(data))
-                    buffer = buffer[pkt_length:]
-
-
-    async def __write(self):
-        async for pkt in self.write_itf.generator():
-            assert isinstance(pkt, LANCET_HEADER)
-            self.write_ep.write(pkt.build())
+                batch += frame
+                frames += 1
+            self.write_ep.write(batch)
+
+            latency = time.perf_counter() - taken
+            if trace.tracer is not None:
+                trace.tracer.record('usb write', latency)
+            stats = self.write_stats
+            stats['transfers'] += 1
+            stats['frames'] += frames
+            stats['bytes'] += len(batch)
+            stats['latency'] += latency
+            if latency > stats['max latency']:
+                stats['max latency'] = latency
+            if self.report_interval is not None and taken - last_report >= self.report_interval:
+                last_report = taken
+                self.print_write_stats()
+
+    def __take_frame(self, block, timeout=None):
+        try:
+            pkt = self.write_itf.get_data(block, timeout)
+        except queue.Empty:
+            return None
+        depth = self.write_itf.qsize()
+        if depth > self.write_stats['max depth']:
+            self.write_stats['max depth'] = depth
+        if isinstance(pkt, bytes):
+            return pkt
+        assert isinstance(pkt, LANCET_HEADER)
+        return pkt.build()
+
+    def print_write_stats(self):
+        stats = self.write_stats
+        if stats['transfers'] == 0:
+            return
+        print(f"[USB] {stats['frames']} frames in {stats['transfers']} transfers, "
+              f"latency mean {stats['latency'] / stats['transfers'] * 1000:.3f} ms "
+              f"max {stats['max latency'] * 1000:.3f} ms, max queue depth {stats['max depth']}")
@@ -1,18 +1,34 @@
 import inspect
 import asyncio
+from collections import deque
+from . import trace
 from .utils import Frag
-from .interface import Interface
+from .interface import Interface, in_loop
 from .vsm import BT_ROLE, BT_IOCAP, VirtualSecurityManager
 from .packet import (
     Packet,
     LANCET_HEADER,
+    LancetFrame,
     SM_Hdr,
     BTLE_WITH_CTE,
     BTLE_DATA_WITH_CTE,
     L2CAP_Hdr,
+    L2CAP_CID_SMP,
 )
 
 
+def packet_key(packet) -> tuple:
+    # LancetFrame.key of a packet that was dissected before
+    direction = packet.Direction if isinstance(packet, LANCET_HEADER) else None
+    data = packet.getlayer(BTLE_DATA_WITH_CTE)
+    llid = data.LLID if data is not None else None
+    l2cap = packet.getlayer(L2CAP_Hdr)
+    if l2cap is None:
+        return direction, llid, None, None
+    sm = l2cap.getlayer(SM_Hdr) if l2cap.cid == L2CAP_CID_SMP else None
+    return direction, llid, l2cap.cid, sm.sm_command if sm is not None else None
+
+
 class HijkerEngine:
     """
     HijkerEngine is the base class for all the engines.
@@ -20,7 +36,12 @@ class HijkerEngine:
     You can override the process method to process the packet
     """
 
+    count = 0
+
     def __init__(self) -> None:
+        # the name of the engine in the latency report
+        HijkerEngine.count += 1
+        self.name = f'{type(self).__name__}{HijkerEngine.count}'
         # incoming_if is a Interface object which provides the incoming packets
         self.incoming_if = None
         # outgoing_if is a Interface object where the outgoing packets are sent
@@ -30,10 +51,20 @@ class HijkerEngine:
 
         self.stop = False
         self.standby = False
+        # the frame the packet in process was dissected from, None if an earlier engine did it
+        self.frame = None
 
     async def process(self, packet) -> list[Packet]:
         yield packet
 
+    def inspects(self, frame: LancetFrame) -> bool:
+        """
+        Whether process needs to see the frame. The other frames are passed on
+        as raw bytes without being dissected. Engines that only look at some of
+        the traffic, e.g. SMP, override it.
+        """
+        return type(self).process is not HijkerEngine.process
+
     async def run(self) -> None:
         if self.incoming_if == None or self.outgoing_if == None:
             raise Exception("incoming_if and outgoing_if must be set")
@@ -41,17 +72,36 @@ class HijkerEngine:
         async for packet in self.incoming_if.generator():
             while self.stop:
                 if packet is None:
-                    self.incoming_if.put_data(packet)
+                    await self.incoming_if.put(packet)
                 else:
                     packet = None
                 await asyncio.sleep(0.1)
 
-            if self.standby:
-                self.outgoing_if.put_data(packet)
-                continue
+            async for pkt in self.handle(packet):
+                await self.outgoing_if.put(pkt)
 
-            async for pkt in self.process(packet):
-                self.outgoing_if.put_data(pkt)
+    async def handle(self, packet):
+        # one stage: pass the packet on in standby or if it is not inspected, else process it.
+        # While tracing, the time of the engine until each packet it yields is recorded,
+        # the later stages excluded
+        start = trace.now() if trace.tracer is not None else None
+        self.frame = None
+        if self.standby or (isinstance(packet, LancetFrame) and not self.inspects(packet)):
+            self.__lap(start)
+            yield packet
+            return
+
+        if isinstance(packet, LancetFrame):
+            self.frame = packet
+            packet = packet.packet
+        async for pkt in self.process(packet):
+            self.__lap(start)
+            yield pkt
+            start = trace.now() if trace.tracer is not None else None
+
+    def __lap(self, start):
+        if start is not None and trace.tracer is not None:
+            trace.tracer.record(self.name, trace.now() - start)
 
     def set_incoming_if(self, incoming_if) -> None:
         if not isinstance(incoming_if, Interface):
@@ -78,18 +128,52 @@ class RuleEngine(HijkerEngine):
     def __init__(self) -> None:
         super().__init__()
         self.rules = []
+        # rule key -> the rules for it, filled as the keys are seen
+        self.dispatch = {}
 
-    def add_rule(self, rule) -> None:
+    def add_rule(self, rule, match=None, direction=None, llid=None, cid=None, opcode=None) -> None:
         """
         rule is a function which takes a packet as input and returns a packet or a list of packets
+        direction, llid, cid (L2CAP channel) and opcode (SMP) restrict the rule to the packets
+        with these values, each one a value or a list of values, e.g. cid=6, opcode=[1, 2].
+        match is a function which takes a LancetFrame and tells whether the rule needs to see it,
+        a packet an earlier engine dissected is given as its LancetFrame.from_packet.
+        A packet runs only the rules it matches, frames no rule matches are not dissected.
         """
         if not callable(rule):
             raise Exception("rule must be a function")
-        self.rules.append(rule)
+        if match is not None and not callable(match):
+            raise Exception("match must be a function")
+        values = []
+        for v in [direction, llid, cid, opcode]:
+            if v is not None and not isinstance(v, (list, tuple, set)):
+                v = [v]
+            values.append(frozenset(v) if v is not None else None)
+        self.rules.append((rule, inspect.iscoroutinefunction(rule), match, values))
+        self.dispatch = {}
+
+    def rules_for(self, key: tuple) -> list:
+        rules = self.dispatch.get(key)
+        if rules is None:
+            rules = [r for r in self.rules
+                     if all(v is None or k in v for k, v in zip(key, r[3]))]
+            self.dispatch[key] = rules
+        return rules
+
+    def inspects(self, frame: LancetFrame) -> bool:
+        return any(match is None or match(frame) for _, _, match, _ in self.rules_for(frame.key()))
 
     async def process(self, packet) -> list[Packet]:
-        for rule in self.rules:
-            if inspect.iscoroutinefunction(rule):
+        frame = self.frame
+        key = frame.key() if frame is not None else packet_key(packet)
+        for rule, is_async, match, _ in self.rules_for(key):
+            if match is not None:
+                if frame is None:
+                    # dissected by an earlier engine, match sees the same frame in every position
+                    frame = LancetFrame.from_packet(packet)
+                if not match(frame):
+                    continue
+            if is_async:
                 packet = await rule(packet)
             else:
                 packet = rule(packet)
@@ -117,11 +201,15 @@ class ImposterEngine(HijkerEngine):
         self.frag = Frag()
         self.vsm = VirtualSecurityManager(iocap, role, 16)
 
+    def inspects(self, frame: LancetFrame) -> bool:
+        # SMP packets and the fragments that may complete one
+        return frame.is_smp or frame.is_continuation
+
     async def process(self, packet):
         assert isinstance(packet, Packet)
         assert packet.haslayer(BTLE_WITH_CTE)
 
-        ble_pkt = self.frag.ressemble(packet[BTLE_WITH_CTE])
+        ble_pkt = self.frag.ressemble(packet[BTLE_WITH_CTE], packet.Direction)
         if ble_pkt is None:
             return
         elif ble_pkt == packet:
@@ -132,16 +220,11 @@ class ImposterEngine(HijkerEngine):
             async for smp_rsp in self.vsm.response_generator(ble_pkt[SM_Hdr]):
                 ble_rsp = BTLE_WITH_CTE() / BTLE_DATA_WITH_CTE() / L2CAP_Hdr() / smp_rsp
                 ble_rsp.access_addr = ble_pkt[BTLE_WITH_CTE].access_addr
-                for fragment in self.frag.fragment(ble_rsp):
-                    rsp = packet.copy()
-                    rsp.payload = fragment
-                    rsp.Direction = 1 - rsp.Direction
-                    yield rsp
+                for pdu in self.frag.fragment(ble_rsp):
+                    yield LancetFrame.from_pdu(packet, pdu, ble_rsp.access_addr, 1 - packet.Direction)
         else:
-            for fragment in self.frag.fragment(ble_pkt):
-                rsp = packet.copy()
-                rsp.payload = fragment
-                yield rsp
+            for pdu in self.frag.fragment(ble_pkt):
+                yield LancetFrame.from_pdu(packet, pdu, ble_pkt.access_addr, packet.Direction)
 
     async def send_pair_request(self, templete) -> None:
         assert isinstance(templete, LANCET_HEADER)
@@ -150,4 +233,100 @@ class ImposterEngine(HijkerEngine):
         async for pkt in self.vsm.response_generator(None):
             p = templete.copy()
             p[L2CAP_Hdr].payload = pkt
-            self.outgoing_if.put_data(p)
+            await self.outgoing_if.put(p)
+
+
+class ChainInterface(Interface):
+    """
+    Takes the place of the queue between two engines of an EngineChain. The
+    packets an engine puts into its outgoing_if on its own, e.g. with
+    ImposterEngine.send_pair_request, go through the rest of the chain.
+    """
+
+    def __init__(self, chain, stage: int) -> None:
+        super().__init__()
+        self.chain = chain
+        self.stage = stage
+
+    def put_data(self, data):
+        self.record(data)
+        loop = self.chain.loop
+        if in_loop() and asyncio.get_running_loop() is loop:
+            self.chain.spawn(self.stage, data)
+        else:
+            loop.call_soon_threadsafe(self.chain.spawn, self.stage, data)
+
+
+class EngineChain(HijkerEngine):
+    """
+    EngineChain runs a chain of engines in one task. The packets an engine
+    yields are fed to the next engine directly instead of through an
+    Interface and another task, standby and stop of every engine still hold:
+    a stopped engine keeps the packets fed to it until it goes on, the other
+    engines of the chain keep running.
+    """
+
+    def __init__(self, engines: list) -> None:
+        super().__init__()
+        for engine in engines:
+            if not isinstance(engine, HijkerEngine):
+                raise Exception("engine must be an instance of HijkerEngine")
+        self.engines = engines
+        self.loop = None
+        self.tasks = set()
+        # the packets waiting for a stopped engine, by stage
+        self.held = [deque() for _ in engines]
+        for i in range(len(engines) - 1):
+            engines[i + 1].set_incoming_if(ChainInterface(self, i + 1))
+            engines[i].set_next_engine(engines[i + 1])
+
+    def set_incoming_if(self, incoming_if) -> None:
+        super().set_incoming_if(incoming_if)
+        self.engines[0].incoming_if = incoming_if
+
+    def set_outgoing_if(self, outgoing_if) -> None:
+        super().set_outgoing_if(outgoing_if)
+        self.engines[-1].outgoing_if = outgoing_if
+
+    async def run(self) -> None:
+        if self.incoming_if == None or self.outgoing_if == None:
+            raise Exception("incoming_if and outgoing_if must be set")
+        self.loop = asyncio.get_running_loop()
+
+        async for packet in self.incoming_if.generator():
+            await self.feed(0, packet)
+
+    async def feed(self, stage: int, packet) -> None:
+        held = self.held[stage]
+        if self.engines[stage].stop or len(held) > 0:
+            # like in its incoming Interface, the packet waits for the engine in order
+            held.append(packet)
+            if len(held) == 1:
+                task = self.loop.create_task(self.resume(stage))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            return
+        await self.pass_on(stage, packet)
+
+    async def resume(self, stage: int) -> None:
+        engine = self.engines[stage]
+        held = self.held[stage]
+        while len(held) > 0:
+            while engine.stop:
+                await asyncio.sleep(0.1)
+            # kept in held while it is processed, so later packets queue behind it
+            await self.pass_on(stage, held[0])
+            held.popleft()
+
+    async def pass_on(self, stage: int, packet) -> None:
+        engine = self.engines[stage]
+        async for pkt in engine.handle(packet):
+            if stage + 1 < len(self.engines):
+                await self.feed(stage + 1, pkt)
+            else:
+                await self.outgoing_if.put(pkt)
+
+    def spawn(self, stage: int, packet) -> None:
+        task = self.loop.create_task(self.feed(stage, packet))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
@@ -1,30 +1,154 @@
 import os
+import time
 import queue
+import struct
+import atexit
 import asyncio
-from scapy.utils import PcapWriter
+import threading
+from collections import deque
+from scapy.compat import raw
+from scapy.utils import PcapWriter, PcapNgWriter
 from scapy.data import DLT_BLUETOOTH_LE_LL, DLT_BLUETOOTH_HCI_H4_WITH_PHDR
-from .packet import LANCET_HEADER, HCI_PHDR_Hdr, BTLE_WITH_CTE
+from . import trace
+from .packet import LANCET_HEADER, LancetFrame, BTLE_WITH_CTE
+
+POLICIES = ['block', 'drop_new', 'drop_old']
+
+
+def in_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def wake(waiters: list):
+    # the waiters are woken in their own loop, safe to call from any thread
+    for loop, waiter in waiters:
+        if in_loop() and asyncio.get_running_loop() is loop:
+            set_done(waiter)
+        else:
+            loop.call_soon_threadsafe(set_done, waiter)
+
+
+def set_done(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
 
 
 class Interface(object):
+    """
+    A packet queue between the stages of a pipeline. Consumers are woken up as
+    soon as a packet is put, also when it is put from another thread such as
+    the USB read thread, instead of polling the queue.
+
+    maxsize bounds the queue (0 for unbounded). When it is full, 'block' makes
+    producer threads and put() wait for space, 'drop_new' drops the new packet
+    and 'drop_old' drops the oldest queued packet. Coroutines must use put(),
+    put_data raises queue.Full from the event loop instead of blocking it.
+
+    While tracing, a named interface records how long each packet waited in it,
+    last_stamp is when the packet taken last was put.
+    """
     __rfile__ = None
-    
-    def __init__(self) -> None:
-        self.__buffer__ = queue.Queue()
+
+    def __init__(self, maxsize: int = 0, policy: str = 'block', name: str = None) -> None:
+        if policy not in POLICIES:
+            raise Exception(f"policy must be one of {', '.join(POLICIES)}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.dropped = 0
+        self.last_stamp = None
+        # (packet, put time), the time is None while tracing is off
+        self.__buffer__ = deque()
+        self.__cond__ = threading.Condition()
+        # futures of the coroutines waiting for a packet or for space
+        self.__getters__ = []
+        self.__putters__ = []
+
+    def __full__(self) -> bool:
+        return self.maxsize > 0 and len(self.__buffer__) >= self.maxsize
 
     def put_data(self, data):
-        self.record(data)
-        self.__buffer__.put(data)
+        with self.__cond__:
+            if self.__full__():
+                if self.policy == 'drop_new':
+                    self.dropped += 1
+                    return
+                elif self.policy == 'drop_old':
+                    self.__buffer__.popleft()
+                    self.dropped += 1
+                elif in_loop():
+                    # the event loop must not block, coroutines use put()
+                    raise queue.Full
+                else:
+                    self.__cond__.wait_for(lambda: not self.__full__())
+            # only the packets that are forwarded are recorded
+            self.record(data)
+            stamp = trace.now() if trace.tracer is not None and self.name is not None else None
+            self.__buffer__.append((data, stamp))
+            self.__cond__.notify_all()
+            getters = list(self.__getters__)
+            self.__getters__.clear()
+        wake(getters)
+
+    async def put(self, data):
+        # wait for space in a bounded 'block' interface without blocking the loop
+        while True:
+            while self.policy == 'block' and self.__full__():
+                await self.__wait__(self.__putters__, lambda: not self.__full__())
+            try:
+                self.put_data(data)
+                return
+            except queue.Full:
+                # a producer thread took the space in between
+                pass
+
+    def __pop__(self, block: bool, timeout=None):
+        with self.__cond__:
+            if block:
+                self.__cond__.wait_for(lambda: len(self.__buffer__) > 0, timeout)
+            if len(self.__buffer__) == 0:
+                return False, None
+            data, stamp = self.__buffer__.popleft()
+            self.last_stamp = stamp
+            if stamp is not None and trace.tracer is not None:
+                trace.tracer.record(f'{self.name} queue', trace.now() - stamp)
+            self.__cond__.notify_all()
+            putters = list(self.__putters__)
+            self.__putters__.clear()
+        wake(putters)
+        return True, data
 
-    def get_data(self):
-        return self.__buffer__.get()
+    def get_data(self, block=True, timeout=None):
+        # for consumer threads, raises queue.Empty like queue.Queue.get
+        found, data = self.__pop__(block, timeout)
+        if not found:
+            raise queue.Empty
+        return data
+
+    def qsize(self) -> int:
+        return len(self.__buffer__)
 
     async def generator(self):
         while True:
-            if not self.__buffer__.empty():
-                yield self.__buffer__.get()
+            found, data = self.__pop__(False)
+            if found:
+                yield data
             else:
-                await asyncio.sleep(0.01)
+                await self.__wait__(self.__getters__, lambda: len(self.__buffer__) > 0)
+
+    async def __wait__(self, waiters: list, ready):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self.__cond__:
+            # the state may have changed since it was checked
+            if ready():
+                return
+            waiters.append((loop, waiter))
+        await waiter
 
     def record(self, data):
         if self.__rfile__ == None:
@@ -42,50 +166,105 @@ class Interface(object):
 
 
 class InterfaceRecordFile(object):
-    def __init__(self, rtype: str, layer: str, filename: str):
-        assert rtype in ['text', 'pcap', 'pipe']
+    """
+    Records the packets put into interfaces. The forwarding path only appends
+    the packet and a timestamp to a deque, a writer thread builds them and
+    writes them in batches, flushing every flush_interval seconds. The
+    packets must not be modified after they are put.
+
+    rtype 'pcap' and 'pcapng' write a capture file, 'pipe' streams to wireshark
+    and 'text' keeps one hex line per packet, rendered later by ble_lancet.render.
+    """
+
+    def __init__(self, rtype: str, layer: str, filename: str, flush_interval: float = 0.1):
+        assert rtype in ['text', 'pcap', 'pcapng', 'pipe']
         assert layer in ['link', 'hci']
         assert filename != None or filename != ""
 
         self.rtype = rtype
         self.layer = layer
         self.filename = filename
+        self.flush_interval = flush_interval
         self.file = self.create_file()
+        # (time, packet), appended by the interfaces and popped by the writer
+        self.queue = deque()
+        self.closed = threading.Event()
+        self.writer = threading.Thread(target=self.__write_thread, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
 
     def create_file(self):
+        linktype = DLT_BLUETOOTH_LE_LL if self.layer == 'link' else DLT_BLUETOOTH_HCI_H4_WITH_PHDR
         if self.rtype == 'text':
-            return open(self.filename, "w")
+            return open(self.filename, "a")
         elif self.rtype == 'pcap':
-            if self.layer == 'link':
-                return PcapWriter(self.filename, append=True, sync=True, linktype=DLT_BLUETOOTH_LE_LL)
-            elif self.layer == 'hci':
-                return PcapWriter(self.filename, append=True, sync=True, linktype=DLT_BLUETOOTH_HCI_H4_WITH_PHDR)
+            return PcapWriter(self.filename, append=True, linktype=linktype)
+        elif self.rtype == 'pcapng':
+            writer = PcapNgWriter(self.filename)
+            writer.linktype = linktype
+            return writer
         elif self.rtype == 'pipe':
             if not os.path.exists(self.filename):
                 os.mkfifo(self.filename)
             # use wireshark to open the pipe
             os.system(f"wireshark -k -i {self.filename} &")
-            if self.rtype == 'link':
-                return PcapWriter(self.filename, linktype=DLT_BLUETOOTH_LE_LL)
-            elif self.rtype == 'hci':
-                return PcapWriter(self.filename, linktype=DLT_BLUETOOTH_HCI_H4_WITH_PHDR)
+            return PcapWriter(self.filename, linktype=linktype)
         else:
-            raise Exception("rtype must be text, pcap or pipe")
+            raise Exception("rtype must be text, pcap, pcapng or pipe")
 
     def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.writer.join()
         self.file.close()
 
     def write(self, data):
-        if not isinstance(data, LANCET_HEADER):
+        # on the forwarding path, the packet is built later by the writer
+        if not isinstance(data, (LancetFrame, LANCET_HEADER)):
             raise Exception("data must be an instance of LANCET_HEADER")
+        self.queue.append((time.time(), data))
 
-        if self.rtype == 'text':
-            self.file.write(data.show(dump=True))
-        elif self.rtype == 'pcap' or self.rtype == 'pipe':
-            if self.layer == 'hci':
-                assert isinstance(data.payload, HCI_PHDR_Hdr)
-                self.file.write(data.payload.build())
+    def __write_thread(self):
+        while not self.closed.wait(self.flush_interval):
+            self.__write_batch()
+        self.__write_batch()
+
+    def __write_batch(self):
+        if len(self.queue) == 0:
+            return
+        if self.rtype != 'text' and not self.file.header_present:
+            self.file.write_header(None)
+        while len(self.queue) > 0:
+            t, data = self.queue.popleft()
+            frame = isinstance(data, LancetFrame)
+            if frame:
+                data, fix_crc = data.raw, False
             else:
-                assert isinstance(data.payload, BTLE_WITH_CTE)
-                data = data.payload.remove_cte()
-                self.file.write(data.build())
+                btle = data.getlayer(BTLE_WITH_CTE)
+                data, fix_crc = raw(data), btle is not None and btle.crc is None
+            if self.rtype == 'text':
+                self.file.write(f"{t:.6f} {self.layer} {'frame' if frame else 'packet'} {data.hex()}\n")
+                continue
+            data = record_bytes(data, self.layer == 'hci', fix_crc, frame)
+            if self.rtype == 'pcapng':
+                self.file.write_packet(data, sec=t)
+            else:
+                self.file.write_packet(data, sec=int(t), usec=int((t - int(t)) * 1000000))
+        self.file.flush()
+
+
+def record_bytes(data: bytes, hci: bool, fix_crc: bool, frame: bool) -> bytes:
+    """
+    The bytes of a lancet frame as they are captured: link layer packets
+    without the cte info, HCI packets after their PHDR header.
+    """
+    payload = data[4 + data[3]:]
+    if hci:
+        if not frame:
+            # the PHDR header is already part of a dissected packet
+            return payload
+        return struct.pack('>I', 1 - (data[1] >> 5 & 1)) + payload
+    pdu = payload[4:6] + payload[7:-3]
+    crc = BTLE_WITH_CTE.compute_crc(pdu) if fix_crc else payload[-3:]
+    return payload[:4] + pdu + crc
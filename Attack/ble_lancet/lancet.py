@@ -2,15 +2,15 @@ import asyncio
 import struct
 from enum import Enum
 from scapy.packet import Raw
+from . import trace
 from .blusb import BLancetUSB
-from .engine import HijkerEngine
+from .engine import HijkerEngine, EngineChain
 from .interface import Interface
 from .packet import (
     Packet,
     LANCET_HEADER,
-    BTLE_WITH_CTE,
+    LancetFrame,
     BTLE_DATA_WITH_CTE,
-    HCI_PHDR_Hdr,
     HCI_Hdr,
 )
 
@@ -50,10 +50,10 @@ class Lancet:
     remote_addr = None
     usb = BLancetUSB(0x2FE3, 0x000B)
     interfaces = {
-        LancetItfID.Local2Lancet: Interface(),
-        LancetItfID.Lancet2Local: Interface(),
-        LancetItfID.Remote2Lancet: Interface(),
-        LancetItfID.Lancet2Remote: Interface(),
+        LancetItfID.Local2Lancet: Interface(name='Local2Lancet'),
+        LancetItfID.Lancet2Local: Interface(name='Lancet2Local'),
+        LancetItfID.Remote2Lancet: Interface(name='Remote2Lancet'),
+        LancetItfID.Lancet2Remote: Interface(name='Lancet2Remote'),
     }
     engine_links = {LancetItfID.Local2Lancet: None, LancetItfID.Remote2Lancet: None}
 
@@ -69,20 +69,36 @@ class Lancet:
         # process the outgoing packet of the lancet interface
         itf = self.interfaces[lif_id]
         async for pkt in itf.generator():
+            if trace.tracer is not None:
+                stamp = getattr(pkt, 'stamp', None)
+                if stamp is not None:
+                    trace.tracer.record('pipeline', trace.now() - stamp)
+
+            if isinstance(pkt, LancetFrame):
+                # no engine inspected it, written back without scapy
+                await self.usb.write_itf.put(pkt.outgoing())
+                continue
+
+            # a new header, the packet may still be built by the recorder of the interface
+            out = LANCET_HEADER(**pkt.fields)
             if self.layer == LancetLayer.HCI:
-                pkt.payload = pkt.payload[HCI_Hdr]
+                out.add_payload(pkt.payload[HCI_Hdr])
             else:
-                pkt.payload = pkt.payload[BTLE_DATA_WITH_CTE]
+                out.add_payload(pkt.payload[BTLE_DATA_WITH_CTE])
 
-            if isinstance(pkt.payload, Packet):
-                pkt.len = len(pkt.payload.build())
-            self.usb.write_itf.put_data(pkt)
+            if isinstance(out.payload, Packet):
+                out.len = len(out.payload.build())
+            await self.usb.write_itf.put(out)
 
     async def usb_listener(self):
         # process the incoming packet of the usb interface
-        async for pkt in self.usb.read_itf.generator():
-            if isinstance(pkt, LANCET_HEADER):
-                if pkt.Control == 1:
+        async for raw in self.usb.read_itf.generator():
+            if isinstance(raw, bytes):
+                start = trace.now() if trace.tracer is not None else None
+                frame = LancetFrame(raw, self.layer == LancetLayer.HCI)
+                frame.stamp = self.usb.read_itf.last_stamp
+                if frame.control:
+                    pkt = frame.header
                     payload = pkt.payload.load
                     ctrl_code = ControlCode(pkt.extra[0])
                     if ctrl_code == ControlCode.BM_CTRL_RET_ADDR:
@@ -91,7 +107,8 @@ class Lancet:
                         self.remote_addr = payload[7:]
                     continue
 
-                if pkt.Debug == 1:
+                if frame.debug:
+                    pkt = frame.header
                     flags = pkt.extra
                     DBG_MAP = {
                         0: "plain",
@@ -116,21 +133,17 @@ class Lancet:
 
                     continue
 
-                if self.layer == LancetLayer.HCI:
-                    phdr_hdr = HCI_PHDR_Hdr()
-                    phdr_hdr.direction = 1 - pkt.Direction
-                    pkt.payload = phdr_hdr / HCI_Hdr(pkt.payload.load)
-                else:
-                    pkt.payload = BTLE_WITH_CTE(pkt.payload.load)
-
-                if pkt.Direction == 0:
+                # the engines dissect the frames they inspect, see HijkerEngine.inspects
+                if start is not None and trace.tracer is not None:
+                    trace.tracer.record('decode', trace.now() - start)
+                if frame.direction == 0:
                     # TX Direction from local device
                     itf = self.interfaces[LancetItfID.Local2Lancet]
-                    itf.put_data(pkt)
+                    await itf.put(frame)
                 else:
                     # RX Direction from remote device
                     itf = self.interfaces[LancetItfID.Remote2Lancet]
-                    itf.put_data(pkt)
+                    await itf.put(frame)
             else:
                 raise Exception("Unknown packet type")
 
@@ -197,7 +210,7 @@ class Lancet:
 
         print(f"Set public address to {addr.hex()}")
 
-    def set_engine_link(self, iif_id, oif_id, *engines):
+    def set_engine_link(self, iif_id, oif_id, *engines, fused=False):
         """
         This function will tell Lancet, which engines need to process the packets from
         a certain incoming interface and which outgoing interface the processed packets
@@ -206,6 +219,8 @@ class Lancet:
         iif_id: incoming interface id
         oif_id: outgoing interface id
         engines: a list of engines or None, if None, the default HijkerEngine will be used
+        fused: run the engines in one task and feed the packets from one engine to the
+               next directly, else every engine has its own task and incoming Interface
         """
         assert iif_id in INCOMING_IFS
         assert oif_id in OUTGOING_IFS
@@ -219,6 +234,14 @@ class Lancet:
         if len(engines) == 0:
             engines = [HijkerEngine()]
 
+        if fused and len(engines) > 1:
+            chain = EngineChain(list(engines))
+            chain.set_incoming_if(iif)
+            chain.set_outgoing_if(oif)
+            self.tasks.append(asyncio.create_task(chain.run()))
+            self.engine_links[iif_id] = engines[0]
+            return
+
         engines[0].set_incoming_if(iif)
         for i in range(len(engines) - 1):
             engines[i + 1].set_incoming_if(Interface())
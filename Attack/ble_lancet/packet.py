@@ -1,5 +1,6 @@
 import struct
-from scapy.compat import orb, chb
+import functools
+from scapy.compat import chb
 from scapy.packet import Packet, bind_layers
 from scapy.layers.bluetooth import *
 from scapy.layers.bluetooth4LE import *
@@ -67,6 +68,28 @@ bind_layers(BTLE_DATA_WITH_CTE, BTLE_CTRL, LLID=3)
 bind_layers(BTLE_DATA_WITH_CTE, BTLE_EMPTY_PDU, {'len': 0, 'LLID': 1})
 
 
+def crc_table() -> list:
+    # the bit serial LFSR of the CRC-24 (polynomial 0x5a6000, reflected) applied to every byte value
+    table = []
+    for i in range(256):
+        state = i
+        for _ in range(8):
+            state = (state >> 1) ^ 0xda6000 if state & 1 else state >> 1
+        table.append(state)
+    return table
+
+
+CRC_TABLE = crc_table()
+REVERSED_BYTES = [int(f'{i:08b}'[::-1], 2) for i in range(256)]
+
+
+@functools.lru_cache(maxsize=256)
+def crc_init_state(init: int) -> int:
+    # the LFSR starts with the bits of every byte of the CRC init reversed, once per connection
+    return REVERSED_BYTES[init & 0xff] + (REVERSED_BYTES[(init >> 8) & 0xff] << 8) \
+        + (REVERSED_BYTES[(init >> 16) & 0xff] << 16)
+
+
 class BTLE_WITH_CTE(Packet):
     name = "BT4LE with CTE"
     fields_desc = [
@@ -88,38 +111,26 @@ class BTLE_WITH_CTE(Packet):
 
     @staticmethod
     def compute_crc(pdu, init=0x555555):
-        def swapbits(a):
-            v = 0
-            if a & 0x80 != 0:
-                v |= 0x01
-            if a & 0x40 != 0:
-                v |= 0x02
-            if a & 0x20 != 0:
-                v |= 0x04
-            if a & 0x10 != 0:
-                v |= 0x08
-            if a & 0x08 != 0:
-                v |= 0x10
-            if a & 0x04 != 0:
-                v |= 0x20
-            if a & 0x02 != 0:
-                v |= 0x40
-            if a & 0x01 != 0:
-                v |= 0x80
-            return v
-
-        state = swapbits(init & 0xff) + (swapbits((init >> 8) & 0xff) << 8) + (swapbits((init >> 16) & 0xff) << 16)  # noqa: E501
-        lfsr_mask = 0x5a6000
-        for i in (orb(x) for x in pdu):
-            for j in range(8):
-                next_bit = (state ^ i) & 1
-                i >>= 1
-                state >>= 1
-                if next_bit:
-                    state |= 1 << 23
-                    state ^= lfsr_mask
+        state = crc_init_state(init)
+        for b in pdu:
+            state = (state >> 8) ^ CRC_TABLE[(state ^ b) & 0xff]
         return struct.pack("<L", state)[:-1]
 
+    @staticmethod
+    def compute_crcs(pdus, init=0x555555) -> list:
+        """
+        CRCs of many PDUs with the same CRC init, e.g. to fix a pcap before replaying it.
+        """
+        start = crc_init_state(init)
+        table = CRC_TABLE
+        crcs = []
+        for pdu in pdus:
+            state = start
+            for b in pdu:
+                state = (state >> 8) ^ table[(state ^ b) & 0xff]
+            crcs.append(struct.pack("<L", state)[:-1])
+        return crcs
+
     def post_build(self, p, pay):
         # Switch payload and CRC
         crc = p[-3:]
@@ -165,3 +176,154 @@ def btle_add_cte(btle: BTLE) -> BTLE_WITH_CTE:
         btle_cte.payload = btle.payload
 
     return btle_cte
+
+
+# magic, flags, packet length, extra size, extra data
+LANCET_HEADER_STRUCT = struct.Struct('<BBBB4s')
+LANCET_FLAG_CONTROL = 0x80
+LANCET_FLAG_DEBUG = 0x40
+LANCET_FLAG_DIRECTION = 0x20
+# access address and the data header with cte before the PDU, crc after it
+BTLE_PDU_OFFSET = 4 + 3
+BTLE_CRC_SIZE = 3
+# packet type and ACL header before the L2CAP header
+HCI_ACL_OFFSET = 1 + 4
+HCI_ACL_TYPE = 0x02
+L2CAP_CID_SMP = 0x0006
+L2CAP_HDR = struct.Struct('<HHB')
+
+
+class LancetFrame(object):
+    """
+    A frame from the dongle kept as raw bytes. The header flags, the LLID, the
+    L2CAP channel and the SMP opcode are read with struct, the scapy packet is
+    only dissected when an engine inspects the frame. Frames no engine inspects
+    are written back to the dongle as they came.
+    """
+    __slots__ = ('raw', 'hci', 'stamp')
+
+    def __init__(self, raw: bytes, hci: bool = False) -> None:
+        self.raw = raw
+        self.hci = hci
+        # when it was read from the dongle, only while tracing
+        self.stamp = None
+
+    @property
+    def control(self) -> bool:
+        return self.raw[1] & LANCET_FLAG_CONTROL != 0
+
+    @property
+    def debug(self) -> bool:
+        return self.raw[1] & LANCET_FLAG_DEBUG != 0
+
+    @property
+    def direction(self) -> int:
+        return 1 if self.raw[1] & LANCET_FLAG_DIRECTION else 0
+
+    @property
+    def payload(self) -> bytes:
+        return self.raw[4 + self.raw[3]:]
+
+    @property
+    def llid(self) -> int:
+        # LLID of the link layer data header, None in the HCI layer
+        if self.hci:
+            return None
+        payload = self.payload
+        return payload[4] & 0x03 if len(payload) > 4 else None
+
+    @property
+    def is_empty(self) -> bool:
+        # empty PDU, the keep alive of a connection event
+        payload = self.payload
+        return not self.hci and len(payload) > 5 and payload[4] & 0x03 == 1 and payload[5] == 0
+
+    @property
+    def is_continuation(self) -> bool:
+        # a fragment of an L2CAP packet that does not start it
+        payload = self.payload
+        if self.hci:
+            return len(payload) > 2 and payload[0] == HCI_ACL_TYPE and (payload[2] >> 4) & 0x03 == 1
+        return len(payload) > 5 and payload[4] & 0x03 == 1 and payload[5] > 0
+
+    def __l2cap(self):
+        payload = self.payload
+        if self.hci:
+            if self.is_continuation or len(payload) < HCI_ACL_OFFSET + L2CAP_HDR.size \
+                    or payload[0] != HCI_ACL_TYPE:
+                return None
+            return L2CAP_HDR.unpack_from(payload, HCI_ACL_OFFSET)
+        if len(payload) < BTLE_PDU_OFFSET + L2CAP_HDR.size + BTLE_CRC_SIZE or payload[4] & 0x03 != 2:
+            return None
+        return L2CAP_HDR.unpack_from(payload, BTLE_PDU_OFFSET)
+
+    @property
+    def cid(self) -> int:
+        # L2CAP channel of a start fragment, None for other frames
+        l2cap = self.__l2cap()
+        return l2cap[1] if l2cap is not None else None
+
+    @property
+    def smp_opcode(self) -> int:
+        l2cap = self.__l2cap()
+        if l2cap is None or l2cap[1] != L2CAP_CID_SMP:
+            return None
+        return l2cap[2]
+
+    @property
+    def is_smp(self) -> bool:
+        return self.smp_opcode is not None
+
+    def key(self) -> tuple:
+        # direction, LLID, L2CAP channel and SMP opcode, what rules are dispatched on
+        l2cap = self.__l2cap()
+        if l2cap is None:
+            return self.direction, self.llid, None, None
+        return self.direction, self.llid, l2cap[1], l2cap[2] if l2cap[1] == L2CAP_CID_SMP else None
+
+    @property
+    def header(self) -> LANCET_HEADER:
+        # the header with a raw payload, for control and debug frames
+        return LANCET_HEADER(self.raw)
+
+    @property
+    def packet(self) -> LANCET_HEADER:
+        # the fully dissected packet, as the engines used to receive it
+        pkt = LANCET_HEADER(self.raw)
+        if self.hci:
+            phdr_hdr = HCI_PHDR_Hdr()
+            phdr_hdr.direction = 1 - pkt.Direction
+            pkt.payload = phdr_hdr / HCI_Hdr(self.payload)
+        else:
+            pkt.payload = BTLE_WITH_CTE(self.payload)
+        if self.stamp is not None:
+            pkt.stamp = self.stamp
+        return pkt
+
+    @classmethod
+    def from_pdu(cls, header: LANCET_HEADER, pdu: bytes, access_addr: int, direction: int):
+        """
+        A link layer frame of a raw data PDU, with the lancet header fields of header.
+        """
+        flags = header.Control << 7 | header.Debug << 6 | direction << 5 | header.reserved
+        payload = struct.pack('<L', access_addr) + pdu + BTLE_WITH_CTE.compute_crc(pdu)
+        head = bytes([LANCET_MAGIC, flags, len(payload) & 0xff, len(header.extra)]) + header.extra
+        return cls(head + payload)
+
+    @classmethod
+    def from_packet(cls, pkt: LANCET_HEADER):
+        """
+        The frame of a dissected packet, the HCI frames without the PHDR header.
+        """
+        data = bytes(pkt)
+        hci = pkt.haslayer(HCI_PHDR_Hdr)
+        if hci:
+            head = 4 + data[3]
+            data = data[:head] + data[head + 4:]
+        return cls(data, hci)
+
+    def outgoing(self) -> bytes:
+        # the frame written to the dongle, the link layer drops access address and crc
+        head = self.raw[:4 + self.raw[3]]
+        payload = self.payload if self.hci else self.payload[4:-BTLE_CRC_SIZE]
+        return head[:2] + bytes([len(payload)]) + head[3:] + payload
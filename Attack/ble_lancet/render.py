@@ -0,0 +1,49 @@
+import sys
+from argparse import ArgumentParser
+from scapy.utils import rdpcap
+
+from .packet import LANCET_HEADER, LancetFrame, BTLE_WITH_CTE, HCI_PHDR_Hdr
+
+
+def text_packets(filename: str):
+    """
+    The packets of a 'text' record file, one line per packet:
+    <time> <layer> <frame|packet> <hex of the lancet frame>
+    """
+    with open(filename, 'r') as f:
+        for line in f:
+            t, layer, kind, data = line.split()
+            data = bytes.fromhex(data)
+            if kind == 'frame':
+                pkt = LancetFrame(data, layer == 'hci').packet
+            else:
+                pkt = LANCET_HEADER(data)
+                if layer == 'hci':
+                    pkt.payload = HCI_PHDR_Hdr(pkt.payload.load)
+                else:
+                    pkt.payload = BTLE_WITH_CTE(pkt.payload.load)
+            pkt.time = float(t)
+            yield pkt
+
+
+def main():
+    parser = ArgumentParser(description='Render a record file of the interfaces as text')
+    parser.add_argument('file', type=str, help="record file, 'text' records or a pcap/pcapng capture")
+    parser.add_argument('-o', type=str, default='', help='output file, defaults to stdout')
+    args = parser.parse_args()
+
+    if args.file.endswith('.pcap') or args.file.endswith('.pcapng'):
+        packets = rdpcap(args.file)
+    else:
+        packets = text_packets(args.file)
+
+    out = open(args.o, 'w') if args.o else sys.stdout
+    for pkt in packets:
+        out.write(f"{pkt.time:.6f}\n")
+        out.write(pkt.show(dump=True))
+    if args.o:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
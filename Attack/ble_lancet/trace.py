@@ -0,0 +1,156 @@
+import math
+import time
+import json
+import threading
+
+# the running tracer, None while tracing is off so the hot path only checks it
+tracer = None
+
+# 4 buckets per doubling, from 1 us to about 17 s
+BUCKETS_PER_OCTAVE = 4
+BUCKETS = 24 * BUCKETS_PER_OCTAVE
+
+
+class LatencyHistogram(object):
+    """
+    Log scale histogram of latencies, the percentiles are the upper bounds
+    of their buckets (within 19%).
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (BUCKETS + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds: float):
+        us = seconds * 1000000
+        i = int(math.log2(us) * BUCKETS_PER_OCTAVE) + 1 if us > 1 else 0
+        self.counts[min(i, BUCKETS)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        rank = p / 100 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c > 0 and seen >= rank:
+                return min(2 ** (i / BUCKETS_PER_OCTAVE) / 1000000, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count > 0 else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Tracer(object):
+    """
+    Latency histograms of the pipeline, by name:
+    '<interface> queue' the time a packet waited in an interface,
+    'decode' the listener of the USB frames, '<engine>' the time an engine took
+    for a packet, 'pipeline' from the USB read to the outgoing interface of the
+    lancet, and 'usb write' the bulk transfer to the dongle.
+    """
+
+    def __init__(self, deadline: float = None) -> None:
+        # e.g. the connection interval, the stages whose p99 exceed it are marked
+        self.deadline = deadline
+        self.histograms = {}
+        self.started = time.monotonic()
+
+    def record(self, name: str, seconds: float):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms.setdefault(name, LatencyHistogram())
+        hist.add(seconds)
+
+    def summary(self) -> dict:
+        return {name: hist.summary() for name, hist in list(self.histograms.items())}
+
+    def report(self) -> str:
+        head = f"{'stage':<28}{'count':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        lines = [head, '-' * len(head)]
+        missed = False
+        for name, s in self.summary().items():
+            over = self.deadline is not None and s['p99'] > self.deadline
+            missed = missed or over
+            lines.append(f"{name:<28}{s['count']:>9}{s['p50'] * 1000:>10.3f}{s['p90'] * 1000:>10.3f}"
+                         f"{s['p99'] * 1000:>10.3f}{s['max'] * 1000:>10.3f}{' !' if over else ''}")
+        if missed:
+            lines.append(f"! p99 over the deadline of {self.deadline * 1000:.2f} ms")
+        return '\n'.join(lines)
+
+    def reset(self):
+        self.histograms = {}
+        self.started = time.monotonic()
+
+
+def now() -> float:
+    return time.monotonic()
+
+
+def enable(deadline: float = None, report_interval: float = None, filename: str = None) -> Tracer:
+    """
+    Start tracing. Every report_interval seconds the report is printed, or
+    appended to filename as a json line.
+    """
+    global tracer
+    tracer = Tracer(deadline)
+    if report_interval is not None:
+        t = threading.Thread(target=dump, args=(tracer, report_interval, filename), daemon=True)
+        t.start()
+    return tracer
+
+
+def disable():
+    global tracer
+    tracer = None
+
+
+def dump(current: Tracer, interval: float, filename: str = None):
+    while tracer is current:
+        time.sleep(interval)
+        if tracer is not current:
+            break
+        if filename is None:
+            print(current.report())
+            continue
+        with open(filename, 'a') as f:
+            f.write(json.dumps({'time': time.time(), 'stages': current.summary()}) + '\n')
+
+
+def register_commands(console):
+    """
+    Add the latency commands to a utils.Console.
+    """
+    def latency(*args):
+        if tracer is None:
+            console.log("Tracing is off, use 'latency-on [deadline ms]'")
+        else:
+            print(tracer.report())
+
+    def latency_on(*args):
+        enable(float(args[0]) / 1000 if len(args) > 0 else None)
+        console.log("Tracing on")
+
+    def latency_reset(*args):
+        if tracer is not None:
+            tracer.reset()
+
+    def latency_off(*args):
+        disable()
+        console.log("Tracing off")
+
+    console.register_command('latency', latency, 'print the latency percentiles of the pipeline stages')
+    console.register_command('latency-on', latency_on, 'start tracing, optionally with a deadline in ms')
+    console.register_command('latency-reset', latency_reset, 'clear the latency histograms')
+    console.register_command('latency-off', latency_off, 'stop tracing')
@@ -1,94 +1,75 @@
-import copy
-from scapy.packet import Raw
 from typing import Generator
-from scapy.layers.bluetooth import L2CAP_Hdr
+from scapy.compat import raw
 from .packet import BTLE_WITH_CTE, BTLE_DATA_WITH_CTE
 
+# data header of a link layer PDU: RFU, MD, SN, NESN, LLID
+LLID_CONTINUE = 0b01
+LLID_START = 0b10
+MD_BIT = 0x10
+KEEP_BITS = 0xec
+
 
 class Frag:
     """
-    Fragment and ressemble L2CAP packets.
+    Fragment and ressemble L2CAP packets on the raw bytes of the link layer
+    PDUs. A packet being ressembled is kept per connection and direction.
     """
 
     def __init__(self, MTU=27) -> None:
         self.MTU = MTU
-        self.__frag_flag = False
-        self.__fragments = []
-        self.__fragments_count = 0
-        self.__fragments_total = 0
-
+        # (access address, direction) -> [first fragment, L2CAP bytes, expected length]
+        self.__pending = {}
 
-    def ressemble(self, pkt: BTLE_WITH_CTE) -> BTLE_WITH_CTE or None:
+    def ressemble(self, pkt: BTLE_WITH_CTE, direction: int = 0) -> BTLE_WITH_CTE or None:
         """
         Ressemble fragmented L2CAP packets.
         """
-        isFragBeg = not self.__frag_flag \
-            and BTLE_DATA_WITH_CTE in pkt and L2CAP_Hdr in pkt \
-            and pkt[BTLE_DATA_WITH_CTE].LLID == 0b10 \
-            and pkt[BTLE_DATA_WITH_CTE].len < pkt[L2CAP_Hdr].len
-
-        if isFragBeg:
-            self.__frag_flag = True
-            self.__fragments.append(pkt)
-            self.__fragments_total = pkt[L2CAP_Hdr].len
-            self.__fragments_count = pkt[BTLE_DATA_WITH_CTE].len - 4
-
-        if self.__frag_flag and BTLE_DATA_WITH_CTE in pkt and pkt[BTLE_DATA_WITH_CTE].LLID == 0x01:
-            self.__fragments.append(pkt)
-            self.__fragments_count += pkt[BTLE_DATA_WITH_CTE].len
-
-        if self.__frag_flag:
-            if self.__fragments_count == self.__fragments_total:
-                # a complete packet, process it
-                pkt = copy.copy(self.__fragments[0])
-                total_len = pkt[BTLE_DATA_WITH_CTE].len
-                total_raw = pkt[L2CAP_Hdr].original
-                for frag in self.__fragments[1:]:
-                    total_raw += frag[BTLE_DATA_WITH_CTE].payload.load
-                    total_len += frag[BTLE_DATA_WITH_CTE].len
-                pkt[BTLE_DATA_WITH_CTE].len = total_len
-                pkt[BTLE_DATA_WITH_CTE].payload = L2CAP_Hdr(total_raw)
-
-                self.__frag_flag = False
-                self.__fragments = []
-                self.__fragments_count = 0
-                self.__fragments_total = 0
-
-                return pkt
-            else:
-                # not a complete packet, return None
-                return None
-        else:
+        if BTLE_DATA_WITH_CTE not in pkt:
             return pkt
+        key = (pkt.access_addr, direction)
+        pdu = memoryview(raw(pkt[BTLE_DATA_WITH_CTE]))
+        llid = pdu[0] & 0x03
+        data = pdu[3:3 + pdu[1]]
+
+        if llid == LLID_START and len(data) >= 4:
+            total = int.from_bytes(data[:2], 'little') + 4
+            if len(data) >= total:
+                # not fragmented
+                self.__pending.pop(key, None)
+                return pkt
+            self.__pending[key] = [pkt, bytearray(data), total]
+            return None
 
-    def fragment(self, pkt: BTLE_WITH_CTE) -> Generator[BTLE_WITH_CTE, None, None]:
+        pending = self.__pending.get(key)
+        if pending is None or llid != LLID_CONTINUE or len(data) == 0:
+            return pkt
+        first, l2cap, total = pending
+        l2cap += data
+        if len(l2cap) < total:
+            return None
+
+        # a complete packet, dissected once from the ressembled bytes
+        del self.__pending[key]
+        hdr = raw(first[BTLE_DATA_WITH_CTE])[0]
+        ble_pkt = BTLE_WITH_CTE(access_addr=first.access_addr, crc=first.crc)
+        return ble_pkt / BTLE_DATA_WITH_CTE(bytes([hdr & ~MD_BIT & 0xff, len(l2cap) & 0xff, 0]) + l2cap)
+
+    def fragment(self, pkt: BTLE_WITH_CTE) -> Generator[bytes, None, None]:
         """
-        Fragment a packet.
+        Fragment a packet into raw link layer PDUs (data header and payload).
         """
-        raw_l2cap = pkt[BTLE_DATA_WITH_CTE].payload.build()
-        l2cap_len = len(raw_l2cap)
-        if l2cap_len <= self.MTU:
-            yield pkt
+        pdu = raw(pkt[BTLE_DATA_WITH_CTE])
+        if pdu[1] <= self.MTU:
+            yield pdu
             return
 
-        for i in range(0, l2cap_len, self.MTU):
-            frag = copy.deepcopy(pkt)
-            if i == 0:
-                frag[BTLE_DATA_WITH_CTE].len = self.MTU
-                frag[BTLE_DATA_WITH_CTE].MD = 1
-                frag[BTLE_DATA_WITH_CTE].LLID = 0b10
-                frag[BTLE_DATA_WITH_CTE].payload = L2CAP_Hdr(raw_l2cap[i:i+self.MTU])
-            elif i + self.MTU >= l2cap_len:
-                frag[BTLE_DATA_WITH_CTE].len = l2cap_len - i
-                frag[BTLE_DATA_WITH_CTE].MD = 0
-                frag[BTLE_DATA_WITH_CTE].LLID = 0b01
-                frag[BTLE_DATA_WITH_CTE].payload = Raw(raw_l2cap[i:])
-            else:
-                frag[BTLE_DATA_WITH_CTE].len = self.MTU
-                frag[BTLE_DATA_WITH_CTE].MD = 1
-                frag[BTLE_DATA_WITH_CTE].LLID = 0b01
-                frag[BTLE_DATA_WITH_CTE].payload = Raw(raw_l2cap[i:i+self.MTU])
-            yield frag
+        view = memoryview(pdu)[3:3 + pdu[1]]
+        keep = pdu[0] & KEEP_BITS
+        for i in range(0, len(view), self.MTU):
+            chunk = view[i:i + self.MTU]
+            llid = LLID_START if i == 0 else LLID_CONTINUE
+            md = MD_BIT if i + self.MTU < len(view) else 0
+            yield bytes([keep | md | llid, len(chunk), 0]) + chunk
 
 
 class Console(object):
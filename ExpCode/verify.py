@@ -10,6 +10,8 @@ parser.add_argument('--lemma', type=str, default="", help='The lemma to verify.'
 parser.add_argument('--remote', action='store_true', help='Remote mode.')
 parser.add_argument('--interactive', action='store_true', help='Interactive mode.')
 parser.add_argument('--root', type=str, default="/work", help='Root directory.')
+parser.add_argument('--threads', type=int, default=os.sysconf("SC_NPROCESSORS_ONLN"),
+                    help='Number of threads of tamarin (-N), defaults to the number of logical cores.')
 
 
 args = parser.parse_args()
@@ -17,6 +19,7 @@ if not args.interactive:
     assert args.m, "Please specify the mid file of generated BLE-SC models."
 lemma = args.lemma
 root = args.root
+threads = args.threads
 assert os.path.exists(root), f"Root directory {root} does not exist."
 
 log = open("verify.log", "w")
@@ -48,14 +51,14 @@ else:
             print(f"Verifying [{current+1}/{total}] {name}")
         if lemma:
             log.write(
-                f'{TAMARIN_PATH} +RTS -N60 -RTS --derivcheck-timeout=0 --saturatio=1 --prove={lemma} {i} --output={o} > {o}.tmp\n')
+                f'{TAMARIN_PATH} +RTS -N{threads} -RTS --derivcheck-timeout=0 --saturatio=1 --prove={lemma} {i} --output={o} > {o}.tmp\n')
             os.system(
-                f'{TAMARIN_PATH} +RTS -N60 -RTS --derivcheck-timeout=0 --saturatio=1 --prove={lemma} {i} --output={o} > {o}.tmp')
+                f'{TAMARIN_PATH} +RTS -N{threads} -RTS --derivcheck-timeout=0 --saturatio=1 --prove={lemma} {i} --output={o} > {o}.tmp')
         else:
             log.write(
-                f'{TAMARIN_PATH} +RTS -N60 -RTS --derivcheck-timeout=0 --saturatio=1 {i} --output={o} > {o}.tmp\n')
+                f'{TAMARIN_PATH} +RTS -N{threads} -RTS --derivcheck-timeout=0 --saturatio=1 {i} --output={o} > {o}.tmp\n')
             os.system(
-                f'{TAMARIN_PATH} +RTS -N60 -RTS --derivcheck-timeout=0 --saturatio=1 {i} --output={o} > {o}.tmp')
+                f'{TAMARIN_PATH} +RTS -N{threads} -RTS --derivcheck-timeout=0 --saturatio=1 {i} --output={o} > {o}.tmp')
         with open(f"{o}.tmp", "r") as f:
             info = f.read()
         with open(o, 'w') as f:
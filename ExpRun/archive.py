@@ -0,0 +1,174 @@
+import os
+import json
+import gzip
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser
+
+from utils.proof import THEORY_ITEMS
+from utils.tamarin import parse_lemma_results, parse_time_info
+
+RESULT_SUFFIX = '_result.spthy'
+GRAPH_DIR = '/proofs/imgs/'
+INDEX_SUFFIX = '.index.json'
+
+
+def lemma_spans(lines: list) -> dict:
+    """
+    Line range [start, end) of every lemma, with its proof, in an output theory.
+    """
+    spans = {}
+    name = None
+    for i, line in enumerate(lines):
+        if name is not None and (line.startswith(THEORY_ITEMS) or line.startswith('summary of summaries')):
+            spans[name][1] = i
+            name = None
+        if line.startswith('lemma '):
+            name = line[len('lemma '):].split(' ')[0].split('[')[0].strip(':')
+            spans[name] = [i, len(lines)]
+    return spans
+
+
+def parse_member(data: bytes) -> dict:
+    text = data.decode('utf8', errors='replace')
+    if 'summary of summaries:' not in text:
+        return None
+    theory, summary = text.split('summary of summaries:')[:2]
+    spans = lemma_spans(theory.split('\n'))
+    lemmas = {}
+    for r in parse_lemma_results(summary):
+        lemmas[r['name']] = {
+            'type': r['type'],
+            'result': r['result'],
+            'steps': int(r['steps']),
+            'lines': spans.get(r['name']),
+        }
+    return {'time': parse_time_info(summary), 'lemmas': lemmas}
+
+
+def build_index(path: str, workers: int) -> dict:
+    """
+    Stream the archive once, the result files are parsed in parallel while
+    the next members are decompressed.
+    """
+    index = {'size': os.path.getsize(path), 'mtime': os.path.getmtime(path), 'cases': {}}
+    graphs = []
+    futures = {}
+    with ProcessPoolExecutor(workers) as pool, tarfile.open(path, 'r:gz') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if member.name.endswith(RESULT_SUFFIX):
+                case = member.name.split('/')[-1][:-len(RESULT_SUFFIX)]
+                index['cases'][case] = {
+                    'member': member.name,
+                    'offset': member.offset_data,
+                    'size': member.size,
+                    'graphs': {},
+                }
+                futures[case] = pool.submit(parse_member, tar.extractfile(member).read())
+            elif GRAPH_DIR in member.name:
+                graphs.append(member)
+
+        for case, future in futures.items():
+            result = future.result()
+            if result is None:
+                index['cases'].pop(case)
+                continue
+            index['cases'][case].update(result)
+
+    # attack graphs are named <case>_result_<lemma>.<format>
+    for member in graphs:
+        filename = member.name.split('/')[-1]
+        for case, data in index['cases'].items():
+            prefix = f'{case}_result_'
+            if filename.startswith(prefix):
+                lemma = filename[len(prefix):].rsplit('.', 1)[0]
+                data['graphs'][lemma] = {'member': member.name, 'offset': member.offset_data,
+                                         'size': member.size}
+    return index
+
+
+def load_index(path: str, workers: int = None, force: bool = False) -> dict:
+    """
+    Load the index of an archive, it is built again if the archive changed.
+    """
+    index_file = f'{path}{INDEX_SUFFIX}'
+    if not force and os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf8') as f:
+            index = json.load(f)
+        if index['size'] == os.path.getsize(path) and index['mtime'] == os.path.getmtime(path):
+            return index
+    index = build_index(path, workers)
+    with open(index_file, 'w', encoding='utf8') as f:
+        json.dump(index, f, indent=4, ensure_ascii=False)
+    return index
+
+
+def read_member(path: str, entry: dict) -> bytes:
+    # the data of a member starts at its offset in the uncompressed stream,
+    # so no tar headers are read on the way
+    with gzip.open(path, 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['size'])
+
+
+def read_proof(path: str, index: dict, case: str, lemma: str) -> str:
+    entry = index['cases'][case]
+    if lemma not in entry['lemmas'] or entry['lemmas'][lemma]['lines'] is None:
+        raise Exception(f'No proof of {lemma} in {case}')
+    start, end = entry['lemmas'][lemma]['lines']
+    lines = read_member(path, entry).decode('utf8', errors='replace').split('\n')
+    return '\n'.join(lines[start:end]).rstrip('\n')
+
+
+def print_summary(index: dict):
+    head = f"{'lemma':<40}{'result':<12}{'steps':>8}"
+    for case, data in sorted(index['cases'].items()):
+        print(f"{case} ({data['time']})")
+        print(head)
+        print('-' * len(head))
+        for lemma, r in data['lemmas'].items():
+            result = r['result'].split(' ')[0]
+            graph = ' graph' if lemma in data['graphs'] else ''
+            print(f"{lemma:<40}{result:<12}{r['steps']:>8}{graph}")
+        print()
+
+
+def main():
+    parser = ArgumentParser(
+        description='Script to summarize result archives and read single proofs without unpacking them')
+    parser.add_argument('archive', type=str, help='result archive, e.g. ../relaxedAssumption/OOB/OOB_RESULT.tar.gz')
+    parser.add_argument('case', type=str, nargs='?', help='case to read a proof from')
+    parser.add_argument('lemma', type=str, nargs='?', help='lemma to print the proof of')
+    parser.add_argument('-j', type=int, default=None, help='parser processes, defaults to the number of cores')
+    parser.add_argument('-f', action='store_true', help='build the index again')
+    parser.add_argument('-o', type=str, default='', help='write the summary as json')
+    parser.add_argument('--graph', type=str, default='', help='write the attack graph of the lemma to this file')
+    args = parser.parse_args()
+
+    index = load_index(args.archive, args.j, args.f)
+    if args.case is None:
+        print_summary(index)
+        if args.o:
+            with open(args.o, 'w', encoding='utf8') as f:
+                json.dump(index['cases'], f, indent=4, ensure_ascii=False)
+        return
+
+    if args.case not in index['cases']:
+        raise Exception(f'{args.case} not found in {args.archive}')
+    if args.lemma is None:
+        print_summary({'cases': {args.case: index['cases'][args.case]}})
+        return
+    if args.graph:
+        graphs = index['cases'][args.case]['graphs']
+        if args.lemma not in graphs:
+            raise Exception(f'No attack graph of {args.lemma} in {args.case}')
+        with open(args.graph, 'wb') as f:
+            f.write(read_member(args.archive, graphs[args.lemma]))
+        return
+    print(read_proof(args.archive, index, args.case, args.lemma))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import subprocess
+from argparse import ArgumentParser
+
+from utils.log import logging
+from utils.tamarin import tamarin_command, parse_lemma_results, parse_time_info, parse_seconds, parse_rts_stats
+from utils.server import LocalServer
+from utils.backend import create_backend, Backend
+from profiler import profile_result_file
+
+EXPCODE_DIR = '../ExpCode'
+ASSO_MODEL_SELECTION = '../BLE_SC_Asso_Model_Selection.txt'
+BENCHMARK_DIR = './benchmark'
+BASELINE = f'{BENCHMARK_DIR}/baseline.json'
+CURRENT = f'{BENCHMARK_DIR}/current.json'
+STARTUP_BASELINE = f'{BENCHMARK_DIR}/startup_baseline.json'
+STARTUP_CURRENT = f'{BENCHMARK_DIR}/startup_current.json'
+# entry points whose cold start is benchmarked
+ENTRY_POINTS = ['verifier', 'crawler']
+LEMMAS_CONF = 'lemmas.json'
+CONTAINER_NAME = 'tamarin_ble_benchmark'
+CHECK_TIME = 1
+
+# a lemma regresses when its mean time grows by more than REL_THRESHOLD and
+# the growth is larger than Z_THRESHOLD standard errors of the difference
+REL_THRESHOLD = 0.10
+Z_THRESHOLD = 3.0
+MEMORY_THRESHOLD = 0.10
+
+sys.path.append(EXPCODE_DIR)
+from generate import BLE_SC_Feature, featrue_filter, IOCapabilitys, OOBCaps, AuthReqs  # noqa: E402
+
+
+def parse_asso_models(path: str) -> dict:
+    """
+    Parse the equations of mapIOCaps2AssM from the FVP results of the association
+    model selection logic, 'x' matches every IO capability.
+    """
+    with open(path, 'r', encoding='utf8') as f:
+        text = f.read()
+    text = text.split('=== Equational Theory')[1]
+    table = {}
+    for i, r, model in re.findall(r'^mapIOCaps2AssM\((\w+),\s*(\w+)\)\s*=\s*(\w+)\.', text, re.M):
+        table[(i, r)] = model
+    return table
+
+
+def asso_model(table: dict, i_feature: BLE_SC_Feature, r_feature: BLE_SC_Feature) -> str:
+    # selectAssM: OOB data is used if present, otherwise the IO capabilities
+    # are only used if one of the devices requires authentication
+    if i_feature.oob != 'NoOOB' or r_feature.oob != 'NoOOB':
+        return 'OOBAS'
+    if i_feature.auth == 'NoAuthReq' and r_feature.auth == 'NoAuthReq':
+        return 'JW'
+    for key in [(i_feature.io, r_feature.io), (i_feature.io, 'x'), ('x', r_feature.io)]:
+        if key in table:
+            return table[key]
+    raise Exception(f'No association model for {i_feature} {r_feature}')
+
+
+def select_cases(keysize='KeyHigh') -> dict:
+    """
+    Select the first generated case of every association model.
+    """
+    table = parse_asso_models(ASSO_MODEL_SELECTION)
+    features = [BLE_SC_Feature(i, o, a, keysize)
+                for i in IOCapabilitys for o in OOBCaps for a in AuthReqs]
+    selected = {}
+    for i_feature in features:
+        for r_feature in features:
+            if not featrue_filter(i_feature, r_feature):
+                continue
+            model = asso_model(table, i_feature, r_feature)
+            if model not in selected:
+                selected[model] = (i_feature, r_feature)
+    return selected
+
+
+def generate_cases(selected: dict, outdir: str) -> dict:
+    cases = {}
+    for model, (i_feature, r_feature) in sorted(selected.items()):
+        device_i = ','.join([i_feature.io, i_feature.oob, i_feature.auth, i_feature.keysize])
+        device_r = ','.join([r_feature.io, r_feature.oob, r_feature.auth, r_feature.keysize])
+        subprocess.run(
+            [sys.executable, 'generate.py', '--device-i', device_i, '--device-r', device_r,
+             '--outdir', os.path.abspath(outdir), '--templete', 'main.m4'],
+            cwd=EXPCODE_DIR, check=True, stdout=subprocess.DEVNULL)
+        cases[model] = f'BLE-SC_I{i_feature}_R{r_feature}.spthy'
+        print(f'{model}: {cases[model]}')
+    return cases
+
+
+def run_lemma(backend: Backend, filename: str, lemma: str, threads: int, run: int) -> dict:
+    workdir = backend.server.workdir
+    casename = filename.split('.')[0]
+    result = f'proofs/{casename}_{lemma}_{run}.spthy'
+    cmd = tamarin_command(f'cases/{filename}', result,
+                          lemmas=[lemma], threads=threads, rts_stats=True)
+
+    start = time.time()
+    backend.run(CONTAINER_NAME, '.', cmd)
+    backend.wait(CONTAINER_NAME, CHECK_TIME)
+    wall = time.time() - start
+
+    with open(f'{workdir}/{result}', 'r', encoding='utf8') as f:
+        summary = f.read().split('summary of summaries:')[1]
+    with open(f'{workdir}/{result}.rts', 'r', encoding='utf8') as f:
+        rts = parse_rts_stats(f.read())
+    lemma_result = [r for r in parse_lemma_results(summary) if r['name'] == lemma][0]
+    profile = profile_result_file(f'{workdir}/{result}').get(lemma, {})
+    return {
+        'wall': round(wall, 2),
+        'time': parse_seconds(parse_time_info(summary)),
+        'steps': int(lemma_result['steps']),
+        'result': lemma_result['result'],
+        'memory': rts['total memory'],
+        'residency': rts['max residency'],
+        'depth': profile.get('depth'),
+        'max_branching': profile.get('max_branching'),
+    }
+
+
+def run_benchmark(lemmas: list, repeat: int, threads: int, runner: str) -> dict:
+    # run in a local container (or process), without ssh and file copies
+    server = LocalServer(BENCHMARK_DIR, runner=runner)
+    backend = create_backend(server)
+    workdir = server.workdir
+    os.makedirs(f'{workdir}/cases', exist_ok=True)
+    os.makedirs(f'{workdir}/proofs', exist_ok=True)
+    cases = generate_cases(select_cases(), f'{workdir}/cases')
+
+    data = {}
+    for model, filename in sorted(cases.items()):
+        casename = filename.split('.')[0]
+        data[casename] = {}
+        for lemma in lemmas:
+            runs = []
+            for run in range(repeat):
+                r = run_lemma(backend, filename, lemma, threads, run)
+                runs.append(r)
+                logging.info(f'Benchmark {model} {lemma} run {run}: {r}')
+                print(f"{model} {lemma} [{run+1}/{repeat}]: {r['time']}s {r['steps']} steps {r['memory']} MiB")
+            data[casename][lemma] = {
+                'model': model,
+                'time': [r['time'] for r in runs],
+                'wall': [r['wall'] for r in runs],
+                'steps': runs[-1]['steps'],
+                'result': runs[-1]['result'],
+                'memory': max(r['memory'] or 0 for r in runs),
+                'residency': max(r['residency'] or 0 for r in runs),
+                'depth': runs[-1]['depth'],
+                'max_branching': runs[-1]['max_branching'],
+            }
+    return data
+
+
+def startup_entry(model: str, times: list) -> dict:
+    # in the layout of a lemma entry, so the startup is compared like the lemmas
+    return {
+        'model': model,
+        'time': times,
+        'wall': times,
+        'steps': 0,
+        'result': 'ok',
+        'memory': 0,
+        'residency': 0,
+        'depth': None,
+        'max_branching': None,
+    }
+
+
+def run_startup(repeat: int, runner: str) -> dict:
+    """
+    Measure the startup of a run: the import of every entry point in a fresh
+    interpreter, and the admission of a local host (image check and slot
+    creation) until its first job could be started.
+    """
+    data = {'startup': {}}
+    for module in ENTRY_POINTS:
+        times = []
+        for run in range(repeat):
+            start = time.time()
+            subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+            times.append(round(time.time() - start, 3))
+        data['startup'][f'import {module}'] = startup_entry('startup', times)
+        print(f"import {module}: {', '.join(f'{t}s' for t in times)}")
+
+    from utils.docker import load_image
+    from verifier import Verifier
+    server = LocalServer(f'{BENCHMARK_DIR}/startup', runner=runner)
+    times = []
+    for run in range(repeat):
+        start = time.time()
+        server.try_connection()
+        if server.runner != 'process':
+            load_image(server)
+        Verifier(server, 0, f'{BENCHMARK_DIR}/startup/results').create()
+        times.append(round(time.time() - start, 3))
+    data['startup']['admit host'] = startup_entry('startup', times)
+    print(f"admit host: {', '.join(f'{t}s' for t in times)}")
+    return data
+
+
+def mean_std(values: list):
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, 0.0
+    var = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+    return mean, math.sqrt(var)
+
+
+def compare(baseline: dict, current: dict) -> list:
+    """
+    Compare the current benchmark with the baseline, returning the regressions.
+    """
+    regressions = []
+    for case in sorted(current):
+        for lemma in sorted(current[case]):
+            if lemma not in baseline.get(case, {}):
+                print(f'{case} {lemma}: no baseline')
+                continue
+            b = baseline[case][lemma]
+            c = current[case][lemma]
+            b_mean, b_std = mean_std(b['time'])
+            c_mean, c_std = mean_std(c['time'])
+            diff = c_mean - b_mean
+            se = math.sqrt(b_std ** 2 / len(b['time']) + c_std ** 2 / len(c['time']))
+            rel = diff / b_mean if b_mean > 0 else 0.0
+
+            issues = []
+            if rel > REL_THRESHOLD and (se == 0 or diff / se > Z_THRESHOLD):
+                issues.append(f'time {round(b_mean, 2)}s -> {round(c_mean, 2)}s (+{round(rel * 100, 1)}%)')
+            if c['steps'] != b['steps']:
+                issues.append(f"steps {b['steps']} -> {c['steps']}")
+            if c['result'] != b['result']:
+                issues.append(f"result {b['result']} -> {c['result']}")
+            if b['memory'] and c['memory'] > b['memory'] * (1 + MEMORY_THRESHOLD):
+                issues.append(f"memory {b['memory']} MiB -> {c['memory']} MiB")
+
+            name = f"[{c['model']}] {lemma}"
+            if issues:
+                regressions.append((case, lemma, issues))
+                print(f"REGRESSION {name}: {'; '.join(issues)}")
+            else:
+                print(f"ok         {name}: {round(b_mean, 2)}s -> {round(c_mean, 2)}s ({round(rel * 100, 1)}%)")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(
+        description='Script to benchmark the models and tactics on one case per association model')
+    parser.add_argument('-l', type=str, default='',
+                        help='comma separated lemmas, defaults to the hypothesis and base lemmas')
+    parser.add_argument('-r', type=int, default=3, help='number of runs of every lemma')
+    parser.add_argument('-N', type=int, default=6, help='number of threads of tamarin')
+    parser.add_argument('-o', type=str, default='',
+                        help=f'output file of the benchmark, defaults to {CURRENT} or {STARTUP_CURRENT}')
+    parser.add_argument('--runner', type=str, default='docker', choices=['docker', 'process'],
+                        help='run tamarin in a local container or as a local process')
+    parser.add_argument('--baseline', type=str, default='',
+                        help=f'baseline file, defaults to {BASELINE} or {STARTUP_BASELINE}')
+    parser.add_argument('--startup', action='store_true',
+                        help='benchmark the startup of verifier.py and crawler.py instead of the lemmas')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save the benchmark as the new baseline')
+    parser.add_argument('--no-run', action='store_true',
+                        help='only compare the output file with the baseline')
+    args = parser.parse_args()
+    if not args.o:
+        args.o = STARTUP_CURRENT if args.startup else CURRENT
+    if not args.baseline:
+        args.baseline = STARTUP_BASELINE if args.startup else BASELINE
+
+    if args.l:
+        lemmas = [l.strip() for l in args.l.split(',')]
+    else:
+        with open(LEMMAS_CONF, 'r', encoding='utf8') as f:
+            config = json.load(f)
+        lemmas = config['HypothesisLemmas'] + config['BaseLemmas']
+
+    if args.no_run:
+        with open(args.o, 'r', encoding='utf8') as f:
+            current = json.load(f)
+    elif args.startup:
+        current = run_startup(args.r, args.runner)
+        with open(args.o, 'w', encoding='utf8') as f:
+            json.dump(current, f, indent=4)
+    else:
+        current = run_benchmark(lemmas, args.r, args.N, args.runner)
+        with open(args.o, 'w', encoding='utf8') as f:
+            json.dump(current, f, indent=4)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf8') as f:
+            json.dump(current, f, indent=4)
+        print(f'Saved baseline to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline found at {args.baseline}, run with --save-baseline first')
+        return
+    with open(args.baseline, 'r', encoding='utf8') as f:
+        baseline = json.load(f)
+    if compare(baseline, current):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+from argparse import ArgumentParser
+
+from utils.log import logging
+from utils.cases import case_sort
+from utils.server import Server, create_server
+from utils.tamarin import tamarin_command, parse_lemma_results, parse_time_info, parse_seconds
+from utils.docker import load_image
+from utils.backend import create_backend
+from utils.tuning import CALIBRATION_CONF, thread_steps, load_calibration, save_calibration, host_curve, best_placement
+
+CASES_DIR = './cases'
+SERVER_CONF = 'servers.json'
+CALIBRATION_DIR = 'calibration'
+CONTAINER_NAME = 'tamarin_ble_calibrate'
+CHECK_TIME = 1
+OUTPUT_DIR = './calibration'
+
+# representative lemmas, one cheap sources lemma and one heavy base lemma
+CALIBRATION_LEMMAS = ['type', 'ASConsistency']
+
+calibration_lock = threading.Lock()
+
+
+def calibrate_server(server: Server, modelfile: str, lemmas: list, full: bool, calibration: dict):
+    server.try_connection()
+    if server.runner != 'process':
+        load_image(server)
+    backend = create_backend(server)
+
+    stdout, _ = server.excute('nproc')
+    cores = int(stdout.strip())
+    filename = modelfile.split('/')[-1]
+    casename = filename.split('.')[0]
+
+    server.excute(f'mkdir -p {CALIBRATION_DIR}/proofs')
+    server.copy_file_to_workdir(modelfile, f'{CALIBRATION_DIR}/{filename}')
+
+    curves = {lemma: {} for lemma in lemmas}
+    for n in thread_steps(cores, full):
+        for lemma in lemmas:
+            result = f'proofs/{casename}_{lemma}_N{n}.spthy'
+            cmd = tamarin_command(filename, result, lemmas=[lemma], threads=n)
+            # run one measurement at a time, so the host is otherwise idle
+            backend.run(CONTAINER_NAME, CALIBRATION_DIR, cmd)
+            backend.wait(CONTAINER_NAME, CHECK_TIME)
+
+            local_result = f'{OUTPUT_DIR}/{server.host}_{casename}_{lemma}_N{n}.spthy'
+            server.copy_file_from_workdir(f'{CALIBRATION_DIR}/{result}', local_result)
+            with open(local_result, 'r', encoding='utf8') as f:
+                content = f.read().split('summary of summaries:')[1]
+            assert any(r['name'] == lemma for r in parse_lemma_results(content)), \
+                f'Failed to find calibration result of {lemma}'
+            seconds = parse_seconds(parse_time_info(content))
+            curves[lemma][n] = seconds
+            logging.info(f'Calibrated {lemma} on {server.host} with -N{n}: {seconds}s')
+            print(f'{server.host}: {lemma} -N{n} {seconds}s')
+
+    workers, threads = best_placement(host_curve(curves), cores)
+    calibration_lock.acquire()
+    calibration[server.host] = {
+        'cores': cores,
+        'model': filename,
+        'workers': workers,
+        'threads': threads,
+        'lemmas': curves,
+    }
+    save_calibration(calibration)
+    calibration_lock.release()
+    print(f'{server.host}: {workers} workers with -N{threads}')
+
+
+def main():
+    parser = ArgumentParser(
+        description='Script to measure the -N scaling curves of every server')
+    parser.add_argument('-m', type=str, default='', help='model file used for calibration')
+    parser.add_argument('-l', type=str, default=','.join(CALIBRATION_LEMMAS),
+                        help='comma separated lemmas used for calibration')
+    parser.add_argument('--host', type=str, default='', help='only calibrate this server')
+    parser.add_argument('--full', action='store_true',
+                        help='measure every -N from 1 to the number of cores')
+    args = parser.parse_args()
+
+    modelfile = args.m
+    if not modelfile:
+        files = [f for f in os.listdir(CASES_DIR) if f.endswith('.spthy')]
+        modelfile = f'{CASES_DIR}/{case_sort(files)[0]}'
+    lemmas = [l.strip() for l in args.l.split(',')]
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    with open(SERVER_CONF, 'r') as f:
+        servers_data = json.load(f)
+    calibration = load_calibration(CALIBRATION_CONF)
+
+    threading_pool = []
+    for s in servers_data:
+        if args.host and s['host'] != args.host:
+            continue
+        server = create_server(s)
+        t = threading.Thread(target=calibrate_server,
+                             args=(server, modelfile, lemmas, args.full, calibration))
+        t.start()
+        threading_pool.append(t)
+
+    for t in threading_pool:
+        t.join()
+
+
+if __name__ == "__main__":
+    logging.info('='*10+' Calibration Starts '+'='*10)
+    main()
+    logging.info('='*10+' Calibration Ends '+'='*12)
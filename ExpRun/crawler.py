@@ -2,14 +2,13 @@ import os
 import time
 import json
 import platform
-import requests
 import threading
-from tqdm import tqdm
 
-from utils.server import Server
+from utils.server import Server, create_server
 from utils.docker import load_image, IMAGE_NAME, IMAGE_VERSION, is_container_exist
 from utils.log import logging
-from utils.tamarin import parse_theory_link, parse_trace_links, parse_img_link, parse_lemma_results, parse_hardware_info, parse_time_info, lemmas_hash
+from utils.tuning import load_calibration, apply_calibration
+from utils.tamarin import parse_theory_link, parse_trace_links, parse_img_link, parse_lemma_results, parse_hardware_info, parse_time_info, lemmas_hash, resource_info
 
 RESULTS = "results"
 IMG_FORMAT = "SVG"
@@ -42,6 +41,7 @@ def add_finished(file: str):
 
 class FilePool():
     def __init__(self, files: list) -> None:
+        from tqdm import tqdm
         self.files = files
         self.pbar = tqdm(total=len(files), desc="Crawling images")
         self.lock = threading.Lock()
@@ -94,6 +94,7 @@ class Crawler():
         self.server.excute(f'docker rm -f {self.name}')
 
     def crawl(self, _file: str):
+        import requests
         if _file in finished:
             return
         
@@ -183,6 +184,7 @@ if __name__ == '__main__':
         # parse lemmas
         cases_data = {}
         spthy_with_trace_files = []
+        from tqdm import tqdm
         for case in tqdm(os.listdir(RESULTS), desc="Parsing results"):
             result_file = os.path.join(RESULTS, case, "result.json")
             with open(result_file, 'r', encoding='utf8') as f:
@@ -211,11 +213,13 @@ if __name__ == '__main__':
             consumed_time = parse_time_info(file_data)
             hardware = parse_hardware_info(file_data)
             lemma_results = parse_lemma_results(file_data)
+            resources = resource_info(lemma_file)
             for lemma in HypothesisLemmas:
                 lemma_result = [l for l in lemma_results if l['name'] == lemma][0]
                 cases_data[case][lemma] = {
                     "time": consumed_time,
                     "hardware": hardware,
+                    "resources": resources,
                     "type": lemma_result["type"],
                     "steps": lemma_result["steps"],
                     "result": result_data[lemma],
@@ -248,6 +252,7 @@ if __name__ == '__main__':
                 cases_data[case][lemma] = {
                     "time": consumed_time,
                     "hardware": hardware,
+                    "resources": resource_info(lemma_file),
                     "type": lemma_result["type"],
                     "steps": lemma_result["steps"],
                     "result": result_data[lemma],
@@ -287,41 +292,46 @@ if __name__ == '__main__':
 
     with open('servers.json', 'r', encoding='utf8') as f:
         servers_data = json.load(f)
-    servers = []
-    for s in servers_data:
-        server = Server(
-            s['host'], s['port'], s['username'],
-            s['password'], s['workdir'],
-            workers=s['workers']
-        )
-        server.connect()
-        servers.append(server)
-
-        load_image(server) # load image
-
-        # send results and uncompress it
-        if not server.is_file_exist(f'./{RESULTS}.tar.gz') or FORCE_PUSH:
-            server.copy_file_to_workdir(f'./{RESULTS}.tar.gz', f'{RESULTS}.tar.gz')
-            server.excute(f'[ -d {RESULTS} ] && rm -rf {RESULTS}')
-            server.excute(f'tar -mxzf {RESULTS}.tar.gz')
-
-    # create crawlers
-    crawlers = []
-    containers_info = {}
-    for server in servers:
+    calibration = load_calibration()
+    spthy_pool = FilePool(spthy_with_trace_files)
+    threading_pool = []
+    crawler_threads = []
+
+    def start_server(s: dict):
+        # servers are prepared in parallel and crawl as soon as they are ready
+        try:
+            server = create_server(s)
+            apply_calibration(server, calibration, s['workers'] == 'auto')
+            server.connect()
+
+            load_image(server) # load image
+
+            # send results and uncompress it
+            if not server.is_file_exist(f'./{RESULTS}.tar.gz') or FORCE_PUSH:
+                server.copy_file_to_workdir(f'./{RESULTS}.tar.gz', f'{RESULTS}.tar.gz')
+                server.excute(f'[ -d {RESULTS} ] && rm -rf {RESULTS}')
+                server.excute(f'tar -mxzf {RESULTS}.tar.gz')
+        except Exception as e:
+            error_write(f"Failed to prepare {s['host']}: {e}")
+            return
+
+        # create crawlers and start crawling
+        crawlers = []
         for i in range(server.workers):
             port = 63001 + i
             name = f'tamarin_result-{server.host}-{port}'.replace('.', '-')
-            crawler = Crawler(port, name, server, i)
-            crawlers.append(crawler)
+            crawlers.append(Crawler(port, name, server, i))
+        for crawler in crawlers:
+            t = threading.Thread(target=crawler.start_worker, args=(spthy_pool,))
+            t.start()
+            crawler_threads.append(t)
 
-    # start crawling
-    threading_pool = []
-    spthy_pool = FilePool(spthy_with_trace_files)
-    for crawler in crawlers:
-        t = threading.Thread(target=crawler.start_worker, args=(spthy_pool,))
+    for s in servers_data:
+        t = threading.Thread(target=start_server, args=(s,))
         threading_pool.append(t)
         t.start()
-
     for t in threading_pool:
         t.join()
+
+    for t in crawler_threads:
+        t.join()
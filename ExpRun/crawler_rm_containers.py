@@ -2,13 +2,12 @@ import os
 import time
 import json
 import platform
-import requests
 import threading
-from tqdm import tqdm
 
-from utils.server import Server
+from utils.server import Server, create_server
 from utils.docker import load_image, IMAGE_NAME, IMAGE_VERSION, is_container_exist
 from utils.log import logging
+from utils.tuning import load_calibration, apply_calibration
 from utils.tamarin import parse_theory_link, parse_trace_links, parse_img_link, parse_lemma_results, parse_hardware_info, parse_time_info, lemmas_hash
 
 RESULTS = "results"
@@ -39,13 +38,12 @@ if __name__ == '__main__':
     
     with open('servers.json', 'r', encoding='utf8') as f:
         servers_data = json.load(f)
+    calibration = load_calibration()
     servers = []
     for s in servers_data:
-        server = Server(
-            s['host'], s['port'], s['username'],
-            s['password'], s['workdir'],
-            workers=s['workers']
-        )
+        auto_workers = s['workers'] == 'auto'
+        server = create_server(s)
+        apply_calibration(server, calibration, auto_workers)
         server.connect()
         servers.append(server)
 
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+import threading
+
+# usage: python3 agent.py start|attach|stop, run in the workdir of a server
+#
+# The daemon runs the jobs found in agent/jobs and writes agent/done/<name>.json
+# with the exit code and the requested output files when a job ends, so jobs
+# keep running and completions are kept while no controller is attached.
+# attach relays one controller connection: it reads submit, stop and ack
+# messages from stdin and writes done and status messages to stdout.
+
+AGENT_DIR = 'agent'
+JOBS_DIR = f'{AGENT_DIR}/jobs'
+STOP_DIR = f'{AGENT_DIR}/stop'
+DONE_DIR = f'{AGENT_DIR}/done'
+STATUS_FILE = f'{AGENT_DIR}/status.json'
+PID_FILE = f'{AGENT_DIR}/agent.pid'
+CHECK_TIME = 1
+STATUS_TIME = 10
+
+
+def write_json(path, data):
+    # write and rename, so readers never see a partial file
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def collect(job, code):
+    files = {}
+    for path in job.get('outputs', []):
+        try:
+            with open(path, 'r', encoding='utf8', errors='replace') as f:
+                files[path] = f.read()
+        except OSError:
+            pass
+    return {'name': job['name'], 'id': job.get('id'), 'code': code, 'files': files}
+
+
+def daemon():
+    running = {}
+    while True:
+        for f in sorted(os.listdir(JOBS_DIR)):
+            name = f[:-len('.json')]
+            if not f.endswith('.json') or name in running:
+                continue
+            job = read_json(f'{JOBS_DIR}/{f}')
+            if job is None:
+                continue
+            # a job of a previous daemon may still be running
+            subprocess.run(job['stop'], shell=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            process = subprocess.Popen(job['command'], shell=True, start_new_session=True,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            running[name] = (job, process)
+
+        for f in os.listdir(STOP_DIR):
+            with open(f'{STOP_DIR}/{f}', 'r') as stop_file:
+                # the id of the submission to stop, a later one of the same name is kept
+                stop_id = stop_file.read().strip()
+            spec = read_json(f'{JOBS_DIR}/{f}.json')
+            if f in running and stop_id in ['', running[f][0].get('id')]:
+                job, process = running[f]
+                subprocess.run(job['stop'], shell=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            elif f not in running and spec is not None and stop_id in ['', spec.get('id')]:
+                os.remove(f'{JOBS_DIR}/{f}.json')
+            os.remove(f'{STOP_DIR}/{f}')
+
+        for name in list(running):
+            job, process = running[name]
+            code = process.poll()
+            if code is None:
+                continue
+            write_json(f'{DONE_DIR}/{name}.json', collect(job, code))
+            # the job may have been resubmitted while it was stopping, that spec is run next
+            spec = read_json(f'{JOBS_DIR}/{name}.json')
+            if spec is not None and spec.get('id') == job.get('id'):
+                os.remove(f'{JOBS_DIR}/{name}.json')
+            running.pop(name)
+
+        write_json(STATUS_FILE, {'time': time.time(), 'running': sorted(running)})
+        time.sleep(CHECK_TIME)
+
+
+def start():
+    for d in [JOBS_DIR, STOP_DIR, DONE_DIR]:
+        os.makedirs(d, exist_ok=True)
+    if os.path.exists(PID_FILE):
+        with open(PID_FILE, 'r') as f:
+            if is_alive(int(f.read().strip())):
+                return
+    process = subprocess.Popen([sys.executable, __file__, 'daemon'], start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(PID_FILE, 'w') as f:
+        f.write(str(process.pid))
+
+
+def stop():
+    if os.path.exists(PID_FILE):
+        with open(PID_FILE, 'r') as f:
+            pid = int(f.read().strip())
+        if is_alive(pid):
+            os.kill(pid, signal.SIGTERM)
+        os.remove(PID_FILE)
+
+
+def attach():
+    lock = threading.Lock()
+    sent = set()
+
+    def send(message):
+        lock.acquire()
+        sys.stdout.write(json.dumps(message) + '\n')
+        sys.stdout.flush()
+        lock.release()
+
+    def stream():
+        last_status = 0
+        while True:
+            for f in sorted(os.listdir(DONE_DIR)):
+                if not f.endswith('.json') or f in sent:
+                    continue
+                done = read_json(f'{DONE_DIR}/{f}')
+                if done is not None:
+                    # marked before sending, the ack may arrive before send returns
+                    sent.add(f)
+                    send(dict(done, op='done'))
+            if time.time() - last_status > STATUS_TIME:
+                status = read_json(STATUS_FILE) or {'time': 0, 'running': []}
+                # the age is computed here, so the clocks of both sides do not matter
+                send({'op': 'status', 'age': time.time() - status['time'],
+                      'running': status['running']})
+                last_status = time.time()
+            time.sleep(CHECK_TIME)
+
+    threading.Thread(target=stream, daemon=True).start()
+    for line in sys.stdin:
+        message = json.loads(line)
+        name = message['name']
+        if message['op'] == 'submit':
+            write_json(f'{JOBS_DIR}/{name}.json', message['job'])
+        elif message['op'] == 'stop':
+            with open(f'{STOP_DIR}/{name}', 'w') as f:
+                f.write(message.get('id') or '')
+        elif message['op'] == 'ack':
+            done = read_json(f'{DONE_DIR}/{name}.json')
+            # the completion of a later submission may have replaced the acked one
+            if done is not None and done.get('id') == message.get('id'):
+                os.remove(f'{DONE_DIR}/{name}.json')
+            # the next job of the same name is sent again
+            sent.discard(f'{name}.json')
+
+
+if __name__ == '__main__':
+    {'start': start, 'stop': stop, 'daemon': daemon, 'attach': attach}[sys.argv[1]]()
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+
+# usage: python3 sampler.py <output> <interval> <pid>
+# samples the CPU and memory use of <pid> and its descendants until it exits
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def read_processes():
+    processes = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                stat = f.read()
+            with open(f'/proc/{pid}/statm', 'r') as f:
+                statm = f.read().split()
+        except OSError:
+            continue
+        # the command name may contain spaces, the fields start after ')'
+        fields = stat[stat.rindex(')') + 2:].split()
+        processes[int(pid)] = {
+            'ppid': int(fields[1]),
+            'ticks': int(fields[11]) + int(fields[12]),
+            'rss': int(statm[1]) * PAGE_SIZE,
+        }
+    return processes
+
+
+def descendants(processes, root):
+    children = {}
+    for pid, p in processes.items():
+        children.setdefault(p['ppid'], []).append(pid)
+    found = []
+    stack = [root]
+    while len(stack) > 0:
+        pid = stack.pop()
+        found.append(pid)
+        stack.extend(children.get(pid, []))
+    return [pid for pid in found if pid in processes and pid != os.getpid()]
+
+
+def main():
+    output, interval, root = sys.argv[1], float(sys.argv[2]), int(sys.argv[3])
+    start = time.time()
+    processes = read_processes()
+    last_ticks = {pid: processes[pid]['ticks'] for pid in descendants(processes, root)}
+    last_time = start
+    with open(output, 'w') as f:
+        while os.path.exists(f'/proc/{root}'):
+            time.sleep(interval)
+            now = time.time()
+            processes = read_processes()
+            pids = descendants(processes, root)
+            if len(pids) == 0:
+                break
+            ticks = {pid: processes[pid]['ticks'] for pid in pids}
+            used = sum(t - last_ticks.get(pid, 0) for pid, t in ticks.items())
+            sample = {
+                't': round(now - start, 1),
+                'cpu': round(used / CLK_TCK / (now - last_time), 2),
+                'rss': round(sum(processes[pid]['rss'] for pid in pids) / 1024 / 1024, 1),
+                'procs': len(pids),
+            }
+            last_ticks = ticks
+            last_time = now
+            f.write(json.dumps(sample) + '\n')
+            f.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import json
+from argparse import ArgumentParser
+
+from utils.proof import parse_tactics, split_lemmas, profile_proof
+from utils.tamarin import parse_lemma_results, parse_time_info
+
+RESULTS = "results"
+OUTPUT_FILE = "profile.json"
+
+
+def profile_result_file(path: str, tactics: dict = None) -> dict:
+    """
+    Profile every lemma that was proven (verified or falsified) in a result file.
+    """
+    with open(path, 'r', encoding='utf8') as f:
+        text = f.read()
+    theory, summary = text.split('summary of summaries:')[:2]
+    if tactics is None:
+        tactics = parse_tactics(theory)
+    proofs = split_lemmas(theory)
+
+    profiles = {}
+    for r in parse_lemma_results(summary):
+        if not r['result'].startswith(('verified', 'falsified')):
+            continue
+        if r['name'] not in proofs:
+            continue
+        proof = proofs[r['name']]
+        profile = profile_proof(proof['proof'], tactics.get(proof['heuristic']))
+        profile['heuristic'] = proof['heuristic']
+        profile['result'] = r['result']
+        profile['time'] = parse_time_info(summary)
+        profiles[r['name']] = profile
+    return profiles
+
+
+def aggregate(cases: dict) -> dict:
+    """
+    Aggregate the goals of all lemmas of all cases by tactic and tactic class.
+    """
+    report = {}
+    for lemmas in cases.values():
+        for profile in lemmas.values():
+            tactic = report.setdefault(profile['heuristic'] or 'default', {})
+            for goal in profile['goals']:
+                c = tactic.setdefault(goal['class'], {
+                    'goals': 0,
+                    'branches': 0,
+                    'max_branches': 0,
+                    'subtree': 0,
+                    'max_subtree': 0,
+                    'example': goal['goal'],
+                })
+                c['goals'] += 1
+                c['branches'] += goal['branches']
+                c['subtree'] += goal['subtree']
+                if goal['subtree'] > c['max_subtree']:
+                    c['max_subtree'] = goal['subtree']
+                    c['example'] = goal['goal']
+                c['max_branches'] = max(c['max_branches'], goal['branches'])
+    return report
+
+
+def print_report(report: dict, top: int):
+    rows = []
+    for tactic, classes in report.items():
+        for name, c in classes.items():
+            rows.append((tactic, name, c))
+    # classes whose goals open the largest subtrees cause the blowups
+    rows.sort(key=lambda r: r[2]['subtree'], reverse=True)
+
+    head = f"{'tactic':<36}{'class':<12}{'goals':>8}{'avg br':>8}{'max br':>8}{'subtree':>10}{'max sub':>9}"
+    print(head)
+    print('-' * len(head))
+    for tactic, name, c in rows[:top]:
+        avg = round(c['branches'] / c['goals'], 2)
+        print(f"{tactic:<36}{name:<12}{c['goals']:>8}{avg:>8}{c['max_branches']:>8}"
+              f"{c['subtree']:>10}{c['max_subtree']:>9}")
+
+
+def main():
+    parser = ArgumentParser(
+        description='Script to profile the proof trees of verified cases by tactic class')
+    parser.add_argument('-r', type=str, default=RESULTS, help='results directory')
+    parser.add_argument('-o', type=str, default=OUTPUT_FILE, help='output file')
+    parser.add_argument('--tactic', type=str, default='',
+                        help='tactic file (e.g. ../ExpCode/includes/tactic.m4i), '
+                             'defaults to the tactics in each result')
+    parser.add_argument('--top', type=int, default=30, help='number of rows to print')
+    args = parser.parse_args()
+
+    tactics = None
+    if args.tactic:
+        with open(args.tactic, 'r', encoding='utf8') as f:
+            tactics = parse_tactics(f.read())
+
+    cases = {}
+    for case in sorted(os.listdir(args.r)):
+        case_dir = os.path.join(args.r, case)
+        if not os.path.isdir(case_dir):
+            continue
+        cases[case] = {}
+        for f in sorted(os.listdir(case_dir)):
+            if not f.endswith('.spthy'):
+                continue
+            profiles = profile_result_file(os.path.join(case_dir, f), tactics)
+            for lemma, profile in profiles.items():
+                # a lemma is profiled once per case, from the first result that contains it
+                if lemma not in cases[case]:
+                    cases[case][lemma] = profile
+
+    report = aggregate(cases)
+    # keep only the number of goals per class for every lemma
+    for lemmas in cases.values():
+        for profile in lemmas.values():
+            classes = {}
+            for goal in profile.pop('goals'):
+                classes[goal['class']] = classes.get(goal['class'], 0) + 1
+            profile['classes'] = classes
+    with open(args.o, 'w', encoding='utf8') as f:
+        json.dump({'cases': cases, 'tactics': report}, f, indent=4, ensure_ascii=False)
+    print_report(report, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import os
+import json
+import heapq
+from argparse import ArgumentParser
+
+from utils.log import logging
+from utils.cases import case_sort
+from utils.tamarin import LemmaTraverser, lemmas_hash, parse_time_info, parse_seconds
+from utils.tuning import load_calibration
+
+CASES_DIR = './cases'
+RESULTS = 'results'
+LEMMAS_CONF = 'lemmas.json'
+SERVER_CONF = 'servers.json'
+POLICIES = ['fifo', 'lpt', 'steal', 'batch']
+
+# tamarin loads and checks the theory again for every job, a batch of lemmas
+# in one job saves this per additional lemma
+JOB_OVERHEAD = 5.0
+
+
+def load_timings(results: str, hypothesis: list) -> dict:
+    """
+    Read the processing time of every lemma job and the result of every lemma
+    of the recorded cases.
+    """
+    cases = {}
+    for case in sorted(os.listdir(results)):
+        result_file = os.path.join(results, case, 'result.json')
+        if not os.path.exists(result_file):
+            continue
+        with open(result_file, 'r', encoding='utf8') as f:
+            result_data = json.load(f)
+
+        times = {}
+        for lemma in result_data:
+            if lemma in hypothesis:
+                name = lemmas_hash(hypothesis.copy())
+            else:
+                name = lemmas_hash([lemma])
+            path = os.path.join(results, case, f'{name}.spthy')
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf8') as f:
+                text = f.read()
+            if 'summary of summaries:' not in text:
+                continue
+            times[lemma] = parse_seconds(parse_time_info(text.split('summary of summaries:')[1]))
+        cases[case] = {
+            'times': times,
+            'results': {l: str(r).startswith('verified') for l, r in result_data.items()},
+        }
+    return cases
+
+
+def median(values: list) -> float:
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[len(values) // 2]
+
+
+class CaseState(object):
+    def __init__(self, case: str, traverser: LemmaTraverser, data: dict, estimate: dict,
+                 overhead: float = JOB_OVERHEAD) -> None:
+        self.case = case
+        self.traverser = traverser
+        self.data = data
+        self.estimate = estimate
+        self.overhead = overhead
+        self.start = None
+        self.end = None
+        self.jobs = None
+        self.hypothesis_started = len(traverser.hypothesis) == 0
+        self.hypothesis_done = len(traverser.hypothesis) == 0
+        self.busy = set()
+
+    def lemma_time(self, lemma: str) -> float:
+        if lemma in self.data['times']:
+            return self.data['times'][lemma]
+        return self.estimate.get(lemma, self.estimate[None])
+
+    def duration(self, lemmas: list) -> float:
+        if lemmas == self.traverser.hypothesis:
+            # the hypothesis lemmas share one job and one processing time
+            return self.lemma_time(lemmas[0])
+        total = sum(self.lemma_time(l) for l in lemmas)
+        return max(total - (len(lemmas) - 1) * self.overhead, 0.0)
+
+    def total(self) -> float:
+        lemmas = [l for l in self.data['times'] if l not in self.traverser.hypothesis[1:]]
+        return sum(self.data['times'][l] for l in lemmas)
+
+    def sequential(self, batch: bool):
+        # the order of Verifier.verify, one job after the other
+        if len(self.traverser.hypothesis) > 0:
+            yield None, self.traverser.hypothesis
+        for lemmas in self.traverser.traverse():
+            if batch:
+                yield None, lemmas
+            else:
+                for l in lemmas:
+                    yield None, [l]
+
+    def ready(self):
+        # lemmas of different graphs do not depend on each other
+        if not self.hypothesis_started:
+            self.hypothesis_started = True
+            return None, self.traverser.hypothesis
+        if not self.hypothesis_done:
+            return None
+        for graph in self.traverser.graphs:
+            if graph in self.busy or graph.is_tranversed():
+                continue
+            self.busy.add(graph)
+            return graph, [graph.pop()]
+        return None
+
+    def complete(self, graph, lemmas: list):
+        if lemmas == self.traverser.hypothesis:
+            self.hypothesis_done = True
+        else:
+            self.traverser.mark_lemmas(lemmas, [self.data['results'].get(l, True) for l in lemmas])
+        self.busy.discard(graph)
+
+    def is_finished(self) -> bool:
+        return self.hypothesis_done and len(self.busy) == 0 and \
+            all(g.is_tranversed() for g in self.traverser.graphs)
+
+
+class CasePolicy(object):
+    """
+    Every slot verifies one case at a time, as verifier.py does.
+    """
+
+    def __init__(self, cases: list, batch: bool = False) -> None:
+        self.queue = cases
+        self.batch = batch
+        self.current = {}
+
+    def take(self, slot: int, now: float):
+        while True:
+            state = self.current.get(slot)
+            if state is None:
+                if len(self.queue) == 0:
+                    return None
+                state = self.queue.pop(0)
+                state.start = now
+                state.jobs = state.sequential(self.batch)
+                self.current[slot] = state
+            job = next(state.jobs, None)
+            if job is not None:
+                return state, job[0], job[1]
+            state.end = now
+            self.current[slot] = None
+
+    def done(self, state: CaseState, graph, lemmas: list, now: float):
+        state.complete(graph, lemmas)
+
+
+class StealPolicy(object):
+    """
+    Free slots take ready lemmas of the started cases, oldest case first,
+    before they start a new case.
+    """
+
+    def __init__(self, cases: list) -> None:
+        self.queue = cases
+        self.active = []
+
+    def take(self, slot: int, now: float):
+        for state in self.active:
+            job = state.ready()
+            if job is not None:
+                return state, job[0], job[1]
+        if len(self.queue) == 0:
+            return None
+        state = self.queue.pop(0)
+        state.start = now
+        self.active.append(state)
+        job = state.ready()
+        return state, job[0], job[1]
+
+    def done(self, state: CaseState, graph, lemmas: list, now: float):
+        state.complete(graph, lemmas)
+        if state.is_finished():
+            state.end = now
+            self.active.remove(state)
+
+
+def simulate(policy, slots: list) -> dict:
+    """
+    Replay the cases on the slots, every slot runs one job at a time at the
+    speed of its host.
+    """
+    events = []
+    free = list(range(len(slots)))
+    busy = [0.0] * len(slots)
+    jobs = 0
+    now = 0.0
+    seq = 0
+    while True:
+        waiting = []
+        for slot in free:
+            job = policy.take(slot, now)
+            if job is None:
+                waiting.append(slot)
+                continue
+            state, graph, lemmas = job
+            duration = state.duration(lemmas) / slots[slot]['speed']
+            busy[slot] += duration
+            jobs += 1
+            heapq.heappush(events, (now + duration, seq, slot, job))
+            seq += 1
+        free = waiting
+        if len(events) == 0:
+            break
+        now, _, slot, (state, graph, lemmas) = heapq.heappop(events)
+        policy.done(state, graph, lemmas, now)
+        free.append(slot)
+    return {'makespan': now, 'busy': busy, 'jobs': jobs}
+
+
+def load_slots(path: str) -> list:
+    with open(path, 'r', encoding='utf8') as f:
+        servers_data = json.load(f)
+    calibration = load_calibration()
+    slots = []
+    for s in servers_data:
+        workers = s.get('workers', 1)
+        if workers == 'auto':
+            workers = calibration.get(s['host'], {}).get('workers', 1)
+        for i in range(workers):
+            slots.append({'host': s['host'], 'num': i, 'speed': s.get('weight', 1)})
+    return slots
+
+
+def make_cases(timings: dict, policy: str, cases_dir: str, estimate: dict, overhead: float) -> list:
+    files = []
+    for c in timings:
+        if os.path.exists(f'{cases_dir}/{c}.spthy'):
+            files.append(f'{c}.spthy')
+        else:
+            logging.warning(f'{cases_dir}/{c}.spthy not found, skipping {c}')
+    cases = []
+    for f in case_sort(files):
+        case = f[:-len('.spthy')]
+        traverser = LemmaTraverser(f'{cases_dir}/{f}', LEMMAS_CONF)
+        cases.append(CaseState(case, traverser, timings[case], estimate, overhead))
+    if policy == 'lpt':
+        # longest processing time first
+        cases.sort(key=lambda c: c.total(), reverse=True)
+    return cases
+
+
+def report(name: str, result: dict, cases: list, slots: list) -> dict:
+    makespan = result['makespan']
+    latency = sorted(c.end - c.start for c in cases if c.end is not None)
+    percentile = lambda p: latency[min(len(latency) - 1, int(p * len(latency)))] if latency else 0.0
+    return {
+        'policy': name,
+        'makespan': round(makespan / 3600, 2),
+        'utilization': round(sum(result['busy']) / (len(slots) * makespan), 3) if makespan > 0 else 0.0,
+        'jobs': result['jobs'],
+        'latency p50': round(percentile(0.5) / 3600, 2),
+        'latency p95': round(percentile(0.95) / 3600, 2),
+        'latency max': round(latency[-1] / 3600, 2) if latency else 0.0,
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description='Script to replay recorded results on a virtual fleet under different scheduling policies')
+    parser.add_argument('-r', type=str, default=RESULTS, help='results directory with the recorded timings')
+    parser.add_argument('-c', type=str, default=CASES_DIR, help='cases directory')
+    parser.add_argument('-s', type=str, default=SERVER_CONF, help='servers.json of the virtual fleet')
+    parser.add_argument('-p', type=str, default=','.join(POLICIES),
+                        help=f"comma separated policies ({', '.join(POLICIES)})")
+    parser.add_argument('--overhead', type=float, default=JOB_OVERHEAD,
+                        help='seconds of a job spent loading the theory, saved by batching lemmas')
+    parser.add_argument('-o', type=str, default='', help='output file of the report')
+    args = parser.parse_args()
+
+    with open(LEMMAS_CONF, 'r', encoding='utf8') as f:
+        config = json.load(f)
+    timings = load_timings(args.r, config['HypothesisLemmas'])
+    # lemmas that were not run in the recorded cases take the median time of
+    # the same lemma in other cases
+    samples = {}
+    for data in timings.values():
+        for lemma, t in data['times'].items():
+            samples.setdefault(lemma, []).append(t)
+    estimate = {lemma: median(ts) for lemma, ts in samples.items()}
+    estimate[None] = median([t for ts in samples.values() for t in ts])
+
+    slots = load_slots(args.s)
+    print(f'{len(timings)} cases on {len(slots)} slots')
+
+    rows = []
+    for name in [p.strip() for p in args.p.split(',')]:
+        if name not in POLICIES:
+            raise Exception(f'Unknown policy {name}')
+        cases = make_cases(timings, name, args.c, estimate, args.overhead)
+        if name == 'steal':
+            policy = StealPolicy(list(cases))
+        else:
+            policy = CasePolicy(list(cases), batch=(name == 'batch'))
+        row = report(name, simulate(policy, slots), cases, slots)
+        logging.info(f'Simulated {name}: {row}')
+        rows.append(row)
+
+    head = f"{'policy':<8}{'makespan':>10}{'util':>8}{'jobs':>8}{'p50':>8}{'p95':>8}{'max':>8}"
+    print(head + '   (hours)')
+    print('-' * len(head))
+    for r in rows:
+        print(f"{r['policy']:<8}{r['makespan']:>10}{r['utilization']:>8}{r['jobs']:>8}"
+              f"{r['latency p50']:>8}{r['latency p95']:>8}{r['latency max']:>8}")
+    if args.o:
+        with open(args.o, 'w', encoding='utf8') as f:
+            json.dump(rows, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
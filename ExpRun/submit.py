@@ -0,0 +1,36 @@
+import json
+from argparse import ArgumentParser
+
+from utils.interactive import request, JOBS_PORT
+
+
+def main():
+    parser = ArgumentParser(
+        description='Script to verify lemmas of a case ahead of the running verifier.py')
+    parser.add_argument('case', type=str, nargs='?', help='case name, e.g. BLE-SC_I[KeyboardDisplay_OOBSend_AuthReq_KeyHigh]_R[KeyboardDisplay_OOBRev_AuthReq_KeyHigh]')
+    parser.add_argument('lemmas', type=str, nargs='*', help='lemmas to verify')
+    parser.add_argument('-m', type=str, default='', help='model file, defaults to cases/<case>.spthy')
+    parser.add_argument('-p', type=int, default=0, help='priority, lower runs first')
+    parser.add_argument('-l', action='store_true', help='list the interactive jobs')
+    parser.add_argument('--no-wait', action='store_true', help='do not wait for the result')
+    parser.add_argument('--port', type=int, default=JOBS_PORT, help='port of the running verifier.py')
+    args = parser.parse_args()
+
+    if args.l:
+        for job in request({'op': 'list'}, args.port)['jobs']:
+            print(f"{job['id']:>4} {job['state']:<9} {job['case']}{job['lemmas']} {job.get('result', '')}")
+        return
+    if args.case is None or len(args.lemmas) == 0:
+        parser.error('a case and at least one lemma are required')
+
+    reply = request({'op': 'submit', 'case': args.case, 'lemmas': args.lemmas,
+                     'model': args.m, 'priority': args.p}, args.port)
+    print(f"Submitted job {reply['id']}")
+    if args.no_wait:
+        return
+    job = request({'op': 'wait', 'id': reply['id']}, args.port)
+    print(json.dumps(job, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+import abc
+import json
+import time
+import uuid
+import threading
+
+from .log import logging
+from .server import Server
+from .docker import is_container_exist, docker_run_command
+from .metrics import metrics, START_BUCKETS
+
+STORE_DIR = 'store'
+AGENT_FILE = 'files/agent.py'
+AGENT_COMMAND = 'python3 agent.py'
+# time to wait for the first status of an agent after connecting
+AGENT_CONNECT_TIME = 30
+
+
+class Backend(abc.ABC):
+    """
+    Backend runs the tamarin jobs of a verifier slot on a server. Commands of a
+    job are run inside the slot directory, so they must use relative paths.
+    """
+
+    def __init__(self, server: Server) -> None:
+        self.server = server
+
+    def store_path(self, filename: str) -> str:
+        """
+        Path of a file of the model store of the host, as seen by a job.
+        """
+        return f'/store/{filename}'
+
+    def run(self, name: str, workdir: str, cmd: str, hostname: str = None, outputs: list = []):
+        with metrics.timer('job_start_seconds', START_BUCKETS, host=self.server.host):
+            self.start(name, workdir, cmd, hostname, outputs)
+
+    @abc.abstractmethod
+    def start(self, name: str, workdir: str, cmd: str, hostname: str, outputs: list):
+        pass
+
+    @abc.abstractmethod
+    def is_running(self, name: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def stop(self, name: str):
+        pass
+
+    def wait(self, name: str, interval: float):
+        while self.is_running(name):
+            time.sleep(interval)
+
+    def lease_alive(self, name: str, heartbeat: str, lease_time: int) -> bool:
+        stdout, _ = self.server.excute(
+            f'[ -f {heartbeat} ] && echo $(( $(date +%s) - $(stat -c %Y {heartbeat}) ))')
+        return stdout.strip() != '' and int(stdout.strip()) < lease_time
+
+    def collect(self, remote: str, local: str) -> bool:
+        """
+        Copy an output file of a job from the server, if it exists.
+        """
+        if not self.server.is_file_exist(remote):
+            return False
+        self.server.copy_file_from_workdir(remote, local)
+        return True
+
+
+class DockerBackend(Backend):
+    """
+    Run every job in its own container, the slot directory is mounted to /work.
+    """
+
+    def start(self, name: str, workdir: str, cmd: str, hostname: str, outputs: list):
+        docker = docker_run_command(
+            name, f'{self.server.workdir}/{workdir}', cmd, hostname=hostname,
+            store=f'{self.server.workdir}/{STORE_DIR}')
+        self.server.excute(docker)
+
+    def is_running(self, name: str) -> bool:
+        return is_container_exist(self.server, name)
+
+    def stop(self, name: str):
+        self.server.excute(f'docker rm -f {name}')
+
+
+class ProcessBackend(Backend):
+    """
+    Run tamarin directly as a process on the server, without docker.
+    """
+
+    def store_path(self, filename: str) -> str:
+        # jobs run in the slot directory, next to the store
+        return f'../{STORE_DIR}/{filename}'
+
+    def pidfile(self, name: str) -> str:
+        return f'{self.server.workdir}/{name}.pid'
+
+    def start(self, name: str, workdir: str, cmd: str, hostname: str, outputs: list):
+        env = f'CONTAIN_HNAME={hostname} ' if hostname is not None else ''
+        # setsid puts the job in its own process group, so stop can kill maude as well.
+        # The subshell execs setsid, so $! is the pid of the group leader
+        job = f'(cd {workdir} && {env}exec setsid nohup bash -c "{cmd}" > /dev/null 2>&1) &'
+        job += f' echo $! > {self.pidfile(name)}'
+        self.server.excute(job)
+
+    def is_running(self, name: str) -> bool:
+        stdout, _ = self.server.excute(
+            f'[ -f {self.pidfile(name)} ] && kill -0 $(cat {self.pidfile(name)}) 2>/dev/null && echo running')
+        return stdout.strip() == 'running'
+
+    def stop(self, name: str):
+        self.server.excute(
+            f'[ -f {self.pidfile(name)} ] && kill -9 -- -$(cat {self.pidfile(name)}) 2>/dev/null; rm -f {self.pidfile(name)}')
+
+
+def heartbeat_command(cmd: str, heartbeat: str, interval: int) -> str:
+    """
+    Touch the heartbeat file every interval seconds while the job shell is
+    alive. The command is run by bash -c "...", so $ is escaped.
+    """
+    loop = f'(while kill -0 \\$\\$ 2>/dev/null; do touch {heartbeat}; sleep {interval}; done)'
+    return f'{loop} & {cmd}'
+
+
+def sampler_command(cmd: str, output: str, interval: int) -> str:
+    """
+    Sample the CPU and memory use of the job shell and its children with
+    sampler.py (copied into the slot) until the job exits.
+    """
+    return f'python3 sampler.py {output} {interval} \\$\\$ & {cmd}'
+
+
+class AgentClient(object):
+    """
+    The connection to the agent (files/agent.py) of a server, shared by its
+    slots. Jobs are submitted, and their completions with the output files
+    and the agent status are streamed back over one long lived command.
+    """
+
+    def __init__(self, server: Server) -> None:
+        self.server = server
+        self.stdin = None
+        self.submitted = set()
+        # the id of the last submission of every job name
+        self.ids = {}
+        self.running = set()
+        self.done = {}
+        self.status_time = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.server.copy_file_to_workdir(AGENT_FILE, 'agent.py')
+        self.server.excute(f'{AGENT_COMMAND} start')
+        self.status_time = 0
+        stdin, stdout = self.server.open_stream(f'{AGENT_COMMAND} attach')
+        threading.Thread(target=self.read, args=(stdout, ), daemon=True).start()
+        self.stdin = stdin
+        # the running jobs are only known after the first status
+        start = time.time()
+        while self.status_time == 0 and time.time() - start < AGENT_CONNECT_TIME:
+            time.sleep(0.1)
+        logging.info(f'Attached to the agent of {self.server.host}')
+
+    def ensure(self):
+        if self.stdin is None:
+            self.lock.acquire()
+            try:
+                if self.stdin is None:
+                    self.connect()
+            finally:
+                self.lock.release()
+
+    def read(self, stdout):
+        try:
+            for line in stdout:
+                message = json.loads(line)
+                if message['op'] == 'done':
+                    # a stopped job of the same name may end after its resubmission,
+                    # the jobs of a previous controller are not known and kept
+                    if self.ids.get(message['name']) in [None, message.get('id')]:
+                        self.done[message['name']] = message
+                        self.submitted.discard(message['name'])
+                    self.send({'op': 'ack', 'name': message['name'], 'id': message.get('id')})
+                elif message['op'] == 'status':
+                    self.running = set(message['running'])
+                    self.status_time = time.time() - message['age']
+        except Exception as e:
+            logging.warning(f'Lost the agent of {self.server.host}: {e}')
+        self.stdin = None
+
+    def send(self, message: dict):
+        self.ensure()
+        try:
+            self.stdin.write(json.dumps(message) + '\n')
+            self.stdin.flush()
+        except Exception:
+            self.stdin = None
+            raise
+
+    def is_running(self, name: str) -> bool:
+        return name in self.submitted or name in self.running
+
+
+agents = {}
+agents_lock = threading.Lock()
+
+
+def agent_client(server: Server) -> AgentClient:
+    agents_lock.acquire()
+    if server.host not in agents or agents[server.host].server is not server:
+        agents[server.host] = AgentClient(server)
+    client = agents[server.host]
+    agents_lock.release()
+    return client
+
+
+class AgentBackend(Backend):
+    """
+    Run every job in a container managed by the agent of the server, without
+    polling: a job costs one submit and one completion message.
+    """
+
+    def __init__(self, server: Server) -> None:
+        super().__init__(server)
+        self.agent = agent_client(server)
+
+    def start(self, name: str, workdir: str, cmd: str, hostname: str, outputs: list):
+        self.agent.done.pop(name, None)
+        job = {
+            'name': name,
+            'id': uuid.uuid4().hex,
+            'command': docker_run_command(
+                name, f'{self.server.workdir}/{workdir}', cmd, hostname=hostname, detach=False,
+                store=f'{self.server.workdir}/{STORE_DIR}'),
+            'stop': f'docker rm -f {name}',
+            'outputs': [f'{workdir}/{o}' for o in outputs],
+        }
+        self.agent.ids[name] = job['id']
+        self.agent.submitted.add(name)
+        self.agent.send({'op': 'submit', 'name': name, 'job': job})
+
+    def is_running(self, name: str) -> bool:
+        try:
+            self.agent.ensure()
+        except Exception as e:
+            logging.warning(f'Failed to attach to the agent of {self.server.host}: {e}')
+        return self.agent.is_running(name)
+
+    def stop(self, name: str):
+        self.agent.send({'op': 'stop', 'name': name, 'id': self.agent.ids.get(name)})
+        self.agent.submitted.discard(name)
+
+    def lease_alive(self, name: str, heartbeat: str, lease_time: int) -> bool:
+        # the agent itself is the heartbeat of its jobs
+        return self.agent.is_running(name) and time.time() - self.agent.status_time < lease_time
+
+    def collect(self, remote: str, local: str) -> bool:
+        for done in list(self.agent.done.values()):
+            if remote in done['files']:
+                with open(local, 'w', encoding='utf8') as f:
+                    f.write(done['files'].pop(remote))
+                return True
+        return super().collect(remote, local)
+
+
+BACKENDS = {
+    'docker': DockerBackend,
+    'process': ProcessBackend,
+    'agent': AgentBackend,
+}
+
+
+def create_backend(server: Server) -> Backend:
+    if server.runner not in BACKENDS:
+        raise Exception(f'Unknown runner {server.runner} of {server.host}')
+    return BACKENDS[server.runner](server)
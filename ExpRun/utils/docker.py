@@ -58,6 +58,21 @@ def is_container_exist(server: Server, container_name):
     return False
 
 
+def docker_run_command(name: str, mount: str, cmd: str, hostname: str = None, detach=True, store: str = None):
+    docker = 'docker run --rm'
+    if detach:
+        docker += ' -d'
+    docker += f' --name {name}'
+    docker += f' -v {mount}:/work'
+    if store is not None:
+        docker += f' -v {store}:/store:ro'
+    docker += ' -w /work'
+    if hostname is not None:
+        docker += f' -e CONTAIN_HNAME={hostname}'
+    docker += f' {IMAGE_NAME}:{IMAGE_VERSION} bash -c "{cmd}"'
+    return docker
+
+
 def load_image(server: Server, force=False):
     loaded = is_image_loaded(server, IMAGE_NAME, IMAGE_VERSION)
 
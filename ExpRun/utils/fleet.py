@@ -0,0 +1,133 @@
+import threading
+
+from .log import logging
+from .metrics import metrics
+
+# weight of the newest lemma job in the measured speed of a host
+SPEED_ALPHA = 0.3
+# in the tail of a run, a host busy with a case finishes it after about half a
+# case on average and the next one after 1.5 cases, so a slower host only takes
+# one of the last cases if it is at least 2/3 as fast as the fastest host
+TAIL_SPEED = 2 / 3
+
+
+class HostStats(object):
+    def __init__(self, host: str, weight: float) -> None:
+        self.host = host
+        self.weight = weight
+        self.speed = None
+        self.jobs = 0
+        self.slots = 0
+        self.hardware = None
+        # calibration seconds of the calibration lemmas at the -N of the host
+        self.reference = None
+        self.draining = False
+        self.failed = False
+
+
+class Fleet(object):
+    """
+    Fleet tracks the hosts of a run and their relative speed. The speed of a
+    host starts from its calibration reference, or its weight in servers.json
+    without one, and is replaced by the measured speed once a lemma job of a
+    case finishes that other hosts have also run. Times of the same lemma are
+    only compared within one case, the cases differ too much.
+    """
+
+    def __init__(self) -> None:
+        self.hosts = {}
+        # (case, lemma) -> {host: seconds}
+        self.lemma_times = {}
+        self.lock = threading.Lock()
+
+    def add(self, host: str, weight: float):
+        self.lock.acquire()
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = HostStats(host, weight)
+            self.hosts[host] = stats
+        stats.weight = weight
+        stats.draining = False
+        stats.failed = False
+        self.lock.release()
+
+    def drain(self, host: str):
+        if host in self.hosts and not self.hosts[host].draining:
+            self.hosts[host].draining = True
+            logging.info(f'Draining {host}')
+            metrics.event('host_drained', host=host)
+
+    def fail(self, host: str):
+        if host in self.hosts and not self.hosts[host].failed:
+            self.hosts[host].failed = True
+            logging.error(f'{host} failed, waiting to re-admit it')
+            metrics.event('host_failed', host=host)
+
+    def is_leaving(self, host: str) -> bool:
+        stats = self.hosts[host]
+        return stats.draining or stats.failed
+
+    def join(self, host: str):
+        self.lock.acquire()
+        self.hosts[host].slots += 1
+        self.lock.release()
+
+    def leave(self, host: str):
+        self.lock.acquire()
+        self.hosts[host].slots -= 1
+        self.lock.release()
+
+    def calibrate(self, host: str, reference: float):
+        if reference is not None and reference > 0:
+            self.hosts[host].reference = reference
+
+    def speed(self, host: str) -> float:
+        stats = self.hosts[host]
+        if stats.speed is not None:
+            return stats.speed
+        references = [s.reference for s in self.hosts.values() if s.reference is not None]
+        if stats.reference is not None:
+            return sum(references) / len(references) / stats.reference
+        weights = [s.weight for s in self.hosts.values()]
+        return stats.weight / (sum(weights) / len(weights))
+
+    def record(self, host: str, case: str, lemma: str, seconds: float, hardware: dict = None):
+        if seconds <= 0:
+            return
+        self.lock.acquire()
+        times = self.lemma_times.setdefault((case, lemma), {})
+        # the work of the lemma as measured by the other hosts, in seconds of a host of speed 1
+        others = [t * self.speed(h) for h, t in times.items() if h != host]
+        times[host] = seconds
+
+        stats = self.hosts[host]
+        if len(others) > 0:
+            ratio = (sum(others) / len(others)) / seconds
+            if stats.speed is None:
+                stats.speed = ratio
+            else:
+                stats.speed = (1 - SPEED_ALPHA) * stats.speed + SPEED_ALPHA * ratio
+            metrics.set('host_speed', round(stats.speed, 3), host=host)
+        stats.jobs += 1
+        if stats.hardware is None and hardware is not None:
+            stats.hardware = hardware
+            logging.info(f"{host}: {hardware['CPU Model']}, {hardware['CPU Logical Cores']} cores")
+        self.lock.release()
+
+    def may_take(self, host: str, remaining: int) -> bool:
+        """
+        Whether a free slot of host may take one of the remaining cases.
+        """
+        if self.is_leaving(host):
+            return False
+        live = [s for s in self.hosts.values()
+                if s.slots > 0 and not s.draining and not s.failed]
+        if remaining > sum(s.slots for s in live):
+            return True
+        fastest = max(self.speed(s.host) for s in live)
+        return self.speed(host) >= TAIL_SPEED * fastest
+
+    def summary(self, host: str) -> str:
+        stats = self.hosts[host]
+        state = 'draining' if stats.draining else 'failed' if stats.failed else 'up'
+        return f'{host} x{round(self.speed(host), 2)} {state}'
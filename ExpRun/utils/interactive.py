@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import socket
+import threading
+import socketserver
+
+from .log import logging
+
+JOBS_PORT = 9465
+
+
+class Preempted(Exception):
+    pass
+
+
+class InteractiveQueue(object):
+    """
+    Ad-hoc lemma jobs submitted during a run. They are taken before the cases
+    of the pool, lower priority first and in the order of submission.
+    """
+
+    def __init__(self) -> None:
+        self.jobs = []
+        self.next_id = 1
+        # set once no slot runs the jobs anymore
+        self.closed = None
+        self.cond = threading.Condition()
+
+    def submit(self, case: str, lemmas: list, model: str, priority: int = 0) -> dict:
+        self.cond.acquire()
+        if self.closed is not None:
+            self.cond.release()
+            raise Exception(self.closed)
+        job = {
+            'id': self.next_id,
+            'case': case,
+            'lemmas': lemmas,
+            'model': model,
+            'priority': priority,
+            'state': 'waiting',
+            'submitted': time.time(),
+        }
+        self.next_id += 1
+        self.jobs.append(job)
+        self.cond.release()
+        logging.info(f"Interactive job {job['id']}: {case}{lemmas}")
+        return job
+
+    def pop(self):
+        self.cond.acquire()
+        waiting = [j for j in self.jobs if j['state'] == 'waiting']
+        job = None
+        if len(waiting) > 0:
+            job = min(waiting, key=lambda j: (j['priority'], j['id']))
+            job['state'] = 'running'
+            job['started'] = time.time()
+        self.cond.release()
+        return job
+
+    def push(self, job: dict):
+        self.cond.acquire()
+        job['state'] = 'waiting'
+        self.cond.release()
+
+    def finish(self, job: dict, result: dict = None, error: str = None):
+        self.cond.acquire()
+        job['state'] = 'failed' if error is not None else 'finished'
+        job['finished'] = time.time()
+        if result is not None:
+            job.update(result)
+        if error is not None:
+            job['error'] = error
+        self.cond.notify_all()
+        self.cond.release()
+
+    def close(self, reason: str):
+        """
+        Reject the jobs submitted from now on and fail the waiting ones.
+        """
+        self.cond.acquire()
+        self.closed = reason
+        for job in self.jobs:
+            if job['state'] == 'waiting':
+                job['state'] = 'failed'
+                job['finished'] = time.time()
+                job['error'] = reason
+        self.cond.notify_all()
+        self.cond.release()
+
+    def waiting(self, older_than: float = 0) -> int:
+        now = time.time()
+        self.cond.acquire()
+        count = len([j for j in self.jobs
+                     if j['state'] == 'waiting' and now - j['submitted'] >= older_than])
+        self.cond.release()
+        return count
+
+    def get(self, id: int) -> dict:
+        self.cond.acquire()
+        found = [dict(j) for j in self.jobs if j['id'] == id]
+        self.cond.release()
+        return found[0] if len(found) > 0 else None
+
+    def wait(self, id: int) -> dict:
+        self.cond.acquire()
+        self.cond.wait_for(lambda: any(j['id'] == id and j['state'] in ['finished', 'failed']
+                                       for j in self.jobs))
+        self.cond.release()
+        return self.get(id)
+
+    def list(self) -> list:
+        self.cond.acquire()
+        jobs = [dict(j) for j in self.jobs]
+        self.cond.release()
+        return jobs
+
+
+def serve(queue: InteractiveQueue, port: int, cases_dir: str):
+    """
+    Accept jobs on a local socket, one JSON message per line:
+    {"op": "submit", "case": ..., "lemmas": [...]}, {"op": "wait", "id": ...}
+    and {"op": "list"}.
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    reply = self.reply(json.loads(line))
+                except Exception as e:
+                    reply = {'error': str(e)}
+                self.wfile.write((json.dumps(reply) + '\n').encode('utf8'))
+                self.wfile.flush()
+
+        def reply(self, message: dict) -> dict:
+            if message['op'] == 'submit':
+                model = message.get('model') or f"{cases_dir}/{message['case']}.spthy"
+                if not os.path.exists(model):
+                    raise Exception(f'Model file {model} not found')
+                job = queue.submit(message['case'], message['lemmas'], model,
+                                   message.get('priority', 0))
+                return {'id': job['id']}
+            elif message['op'] == 'wait':
+                return queue.wait(message['id'])
+            elif message['op'] == 'list':
+                return {'jobs': queue.list()}
+            raise Exception(f"Unknown op {message['op']}")
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(('127.0.0.1', port), Handler)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+
+def request(message: dict, port: int = JOBS_PORT) -> dict:
+    with socket.create_connection(('127.0.0.1', port)) as s:
+        s.sendall((json.dumps(message) + '\n').encode('utf8'))
+        with s.makefile('r', encoding='utf8') as f:
+            reply = json.loads(f.readline())
+    if 'error' in reply:
+        raise Exception(reply['error'])
+    return reply
@@ -0,0 +1,159 @@
+import json
+import time
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, from a cheap sources lemma to a week long base lemma
+PROOF_BUCKETS = [1, 10, 60, 300, 1800, 3600, 14400, 43200, 86400, 259200, 604800]
+COMMAND_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+START_BUCKETS = [0.5, 1, 2, 5, 10, 30, 60]
+# connecting to a host, loading the image and creating its slots
+STARTUP_BUCKETS = [1, 2, 5, 10, 30, 60, 120, 300, 600]
+
+EVENTS_FILE = f'events_{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.jsonl'
+
+
+def label_str(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms labelled by host and slot, rendered in the
+    Prometheus text format, plus an event log with one JSON object per line.
+    """
+
+    def __init__(self) -> None:
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self.lock = threading.Lock()
+        self.events = None
+        self.events_lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, text: str):
+        self.help[name] = (kind, text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.lock.acquire()
+        self.counters[key] = self.counters.get(key, 0) + value
+        self.lock.release()
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.lock.acquire()
+        self.gauges[key] = value
+        self.lock.release()
+
+    def observe(self, name: str, value: float, buckets: list, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.lock.acquire()
+        h = self.histograms.get(key)
+        if h is None:
+            h = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            self.histograms[key] = h
+        for i, b in enumerate(buckets):
+            if value <= b:
+                h['counts'][i] += 1
+        h['sum'] += value
+        h['count'] += 1
+        self.lock.release()
+
+    def timer(self, name: str, buckets: list, **labels):
+        return Timer(self, name, buckets, labels)
+
+    def event(self, kind: str, **fields):
+        record = {'time': round(time.time(), 3), 'event': kind}
+        record.update(fields)
+        self.events_lock.acquire()
+        if self.events is None:
+            self.events = open(EVENTS_FILE, 'a', encoding='utf8')
+        self.events.write(json.dumps(record) + '\n')
+        self.events.flush()
+        self.events_lock.release()
+
+    def render(self) -> str:
+        lines = []
+        self.lock.acquire()
+        groups = {}
+        for (name, labels), value in self.counters.items():
+            groups.setdefault(name, []).append(f'{name}{label_str(labels)} {value}')
+        for (name, labels), value in self.gauges.items():
+            groups.setdefault(name, []).append(f'{name}{label_str(labels)} {value}')
+        for (name, labels), h in self.histograms.items():
+            rows = groups.setdefault(name, [])
+            for b, c in zip(h['buckets'], h['counts']):
+                rows.append(f'{name}_bucket{label_str(labels + (("le", b),))} {c}')
+            rows.append(f'{name}_bucket{label_str(labels + (("le", "+Inf"),))} {h["count"]}')
+            rows.append(f'{name}_sum{label_str(labels)} {round(h["sum"], 3)}')
+            rows.append(f'{name}_count{label_str(labels)} {h["count"]}')
+        self.lock.release()
+
+        for name in sorted(groups):
+            if name in self.help:
+                kind, text = self.help[name]
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+            lines.extend(groups[name])
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, address: str = '127.0.0.1'):
+        # local only by default, like the jobs server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((address, port), Handler)
+        t = threading.Thread(target=httpd.serve_forever, daemon=True)
+        t.start()
+        return httpd
+
+
+class Timer(object):
+    def __init__(self, metrics: Metrics, name: str, buckets: list, labels: dict) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.buckets = buckets
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.time() - self.start
+        self.metrics.observe(self.name, self.seconds, self.buckets, **self.labels)
+
+
+metrics = Metrics()
+metrics.describe('queue_depth', 'gauge', 'Cases waiting in the pool')
+metrics.describe('interactive_queue_depth', 'gauge', 'Interactive jobs waiting for a slot')
+metrics.describe('lemmas_in_flight', 'gauge', 'Lemma jobs running on a slot')
+metrics.describe('lemma_seconds', 'histogram', 'Tamarin processing time of lemma jobs')
+metrics.describe('ssh_command_seconds', 'histogram', 'Latency of commands run on a server')
+metrics.describe('transfer_bytes_total', 'counter', 'Bytes copied to and from a server')
+metrics.describe('job_start_seconds', 'histogram', 'Latency of starting a job container or process')
+metrics.describe('slot_idle_seconds_total', 'counter', 'Time a slot spent between lemma jobs')
+metrics.describe('cases_finished_total', 'counter', 'Cases finished by a slot')
+metrics.describe('job_failures_total', 'counter', 'Failed attempts to verify a case')
+metrics.describe('host_speed', 'gauge', 'Measured relative speed of a host')
+metrics.describe('host_startup_seconds', 'histogram', 'Time from admitting a host until its slots started')
+metrics.describe('first_job_seconds', 'gauge', 'Time from launch until the first lemma job started')
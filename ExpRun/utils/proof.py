@@ -0,0 +1,196 @@
+import re
+from typing import Dict, List
+
+PROOF_STEPS = ('simplify', 'induction', 'solve(', 'by ', 'SOLVED', 'case ', 'next', 'qed')
+THEORY_ITEMS = ('lemma ', 'rule ', 'restriction ', 'tactic:', 'end')
+
+
+class TacticClass(object):
+    def __init__(self, kind: str, index: int) -> None:
+        self.kind = kind  # 'prio' or 'deprio'
+        self.index = index
+        self.regexes = []
+
+    @property
+    def name(self) -> str:
+        return f'{self.kind}[{self.index}]'
+
+    def match(self, goal: str) -> bool:
+        return any(r.search(goal) for r in self.regexes)
+
+
+class Tactic(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.prios = []
+        self.deprios = []
+
+    def classify(self, goal: str) -> str:
+        # tamarin ranks a goal by the first prio it matches, unmatched goals come
+        # after all prios and goals matching a deprio come last
+        for c in self.prios:
+            if c.match(goal):
+                return c.name
+        for c in self.deprios:
+            if c.match(goal):
+                return c.name
+        return 'default'
+
+
+def parse_tactics(text: str) -> Dict[str, Tactic]:
+    """
+    Parse the tactics of a theory (or of tactic.m4i).
+    """
+    tactics = {}
+    tactic = None
+    current = None
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.startswith('//'):
+            continue
+        if line.startswith('tactic:'):
+            tactic = Tactic(line[len('tactic:'):].strip())
+            tactics[tactic.name] = tactic
+            current = None
+        elif tactic is None:
+            continue
+        elif line.startswith('prio:'):
+            current = TacticClass('prio', len(tactic.prios))
+            tactic.prios.append(current)
+        elif line.startswith('deprio:'):
+            current = TacticClass('deprio', len(tactic.deprios))
+            tactic.deprios.append(current)
+        elif line.startswith(THEORY_ITEMS):
+            tactic = None
+            current = None
+        elif current is not None:
+            for r in re.findall(r'regex\s*"((?:[^"\\]|\\.)*)"', line):
+                current.regexes.append(re.compile(r))
+    return tactics
+
+
+def split_lemmas(text: str) -> Dict[str, dict]:
+    """
+    Split a tamarin output theory into its lemmas, returning the heuristic and
+    the proof lines of every lemma.
+    """
+    lemmas = {}
+    lemma = None
+    in_formula = False
+    in_comment = False
+    for line in text.split('\n'):
+        if line.startswith('lemma '):
+            name = re.findall(r'lemma\s+(\w+)', line)[0]
+            heuristic = re.findall(r'heuristic=\{?(\w+)\}?', line)
+            lemma = {'heuristic': heuristic[0] if heuristic else None, 'proof': []}
+            lemmas[name] = lemma
+            in_formula = False
+            in_comment = False
+            continue
+        if lemma is None:
+            continue
+        if line.startswith(THEORY_ITEMS) or line.startswith('summary of summaries'):
+            lemma = None
+            continue
+
+        stripped = line.strip()
+        if in_comment:
+            in_comment = '*/' not in stripped
+            continue
+        if in_formula:
+            in_formula = stripped.count('"') % 2 == 0
+            continue
+        if stripped.startswith('/*') and not lemma['proof']:
+            in_comment = '*/' not in stripped
+            continue
+        if stripped.count('"') % 2 == 1 and not lemma['proof']:
+            in_formula = True
+            continue
+        if lemma['proof'] or stripped.startswith(PROOF_STEPS):
+            lemma['proof'].append(line)
+    return lemmas
+
+
+def proof_steps(lines: List[str]):
+    """
+    Yield (indent, keyword, goal) for every step of a proof, joining goals that
+    tamarin wraps over several lines.
+    """
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        i += 1
+        if not stripped.startswith(PROOF_STEPS):
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        keyword = stripped.split('(')[0].split(' ')[0]
+        goal = ''
+        if keyword == 'solve' or stripped.startswith('by solve('):
+            goal = stripped[stripped.index('solve(') + len('solve('):]
+            depth = goal.count('(') - goal.count(')') + 1
+            while depth > 0 and i < len(lines):
+                goal += ' ' + lines[i].strip()
+                depth += lines[i].count('(') - lines[i].count(')')
+                i += 1
+            goal = goal.strip()
+            if goal.endswith(')'):
+                goal = goal[:-1].strip()
+        yield indent, keyword, goal
+
+
+def profile_proof(lines: List[str], tactic: Tactic = None) -> dict:
+    """
+    Compute the shape of one proof tree: number of steps, depth, the branching
+    of every solved goal and the tactic class the goal belongs to.
+    """
+    profile = {
+        'steps': 0,
+        'depth': 0,
+        'leaves': 0,
+        'traces': 0,
+        'max_branching': 0,
+        'goals': [],
+    }
+    base = None
+    stack = []
+    for indent, keyword, goal in proof_steps(lines):
+        if base is None:
+            base = indent
+        # close the goals whose subtree ends here
+        while len(stack) > 0 and (stack[-1]['indent'] > indent or
+                                  (stack[-1]['indent'] == indent and keyword != 'next')):
+            stack.pop()
+        if keyword == 'qed':
+            continue
+        if keyword == 'case':
+            if len(stack) > 0 and stack[-1]['indent'] == indent - 2:
+                stack[-1]['branches'] += 1
+            continue
+        if keyword == 'next':
+            continue
+
+        profile['steps'] += 1
+        profile['depth'] = max(profile['depth'], (indent - base) // 2)
+        for g in stack:
+            g['subtree'] += 1
+        if keyword == 'by' or keyword == 'SOLVED':
+            profile['leaves'] += 1
+        if keyword == 'SOLVED':
+            profile['traces'] += 1
+        if goal:
+            record = {
+                'indent': indent,
+                'goal': goal,
+                'class': tactic.classify(goal) if tactic is not None else 'default',
+                'branches': 0,
+                'subtree': 0,
+            }
+            profile['goals'].append(record)
+            if keyword == 'solve':
+                stack.append(record)
+
+    for g in profile['goals']:
+        profile['max_branching'] = max(profile['max_branching'], g['branches'])
+        g['depth'] = (g.pop('indent') - base) // 2
+    return profile
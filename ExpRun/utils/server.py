@@ -1,10 +1,14 @@
+import os
+import shutil
 import paramiko
 import threading
+import subprocess
 import time
 from .log import logging
+from .metrics import metrics, COMMAND_BUCKETS
 
 class Server(object):
-    def __init__(self, host, port, username, password, workdir, workers=1, weight=1) -> None:
+    def __init__(self, host, port, username, password, workdir, workers=1, weight=1, threads=6, runner='docker') -> None:
         self.host = host
         self.port = port
         self.username = username
@@ -12,6 +16,10 @@ class Server(object):
         self.workdir = workdir
         self.workers = workers
         self.weight = weight
+        self.threads = threads
+        self.runner = runner
+        self.cores = threads * workers
+        self.curves = {}
         self.finished = True
         self.ssh = None
         self.sftp = None
@@ -55,6 +63,7 @@ class Server(object):
 
     def excute(self, command):
         self.try_connection()
+        start = time.time()
         # excute command
         command = f'cd {self.workdir}; {command}'
         self.lock.acquire()
@@ -75,6 +84,7 @@ class Server(object):
             raise error
         stdout = stdout.read().decode('utf-8')
         stderr = stderr.read().decode('utf-8')
+        metrics.observe('ssh_command_seconds', time.time() - start, COMMAND_BUCKETS, host=self.host)
         if stderr:
             error = f'{self.host}: {stderr}'.strip()
             logging.error(error)
@@ -100,6 +110,7 @@ class Server(object):
         self.lock.release()
         if error:
             raise error
+        metrics.inc('transfer_bytes_total', os.path.getsize(local), host=self.host, direction='up')
 
     def copy_file_from_workdir(self, remote, local):
         self.try_connection()
@@ -120,6 +131,7 @@ class Server(object):
         self.lock.release()
         if error:
             raise error
+        metrics.inc('transfer_bytes_total', os.path.getsize(local), host=self.host, direction='down')
         
     def is_file_exist(self, remote):
         self.try_connection()
@@ -132,4 +144,94 @@ class Server(object):
             exists = False
         self.lock.release()
         return exists
-        
+
+    def open_stream(self, command):
+        """
+        Run a long lived command in the workdir, returning its stdin and stdout.
+        """
+        self.try_connection()
+        self.lock.acquire()
+        try:
+            stdin, stdout, _ = self.ssh.exec_command(f'cd {self.workdir}; {command}')
+        finally:
+            self.lock.release()
+        return stdin, stdout
+
+
+class LocalServer(Server):
+    """
+    The local machine, commands are run as local processes and files are
+    hard linked instead of copied.
+    """
+
+    def __init__(self, workdir, workers=1, weight=1, threads=6, runner='docker', host='localhost') -> None:
+        super().__init__(host, None, None, None, os.path.abspath(workdir),
+                         workers=workers, weight=weight, threads=threads, runner=runner)
+
+    def connect(self):
+        os.makedirs(self.workdir, exist_ok=True)
+
+    def is_connected(self):
+        return os.path.isdir(self.workdir)
+
+    def close(self):
+        pass
+
+    def excute(self, command):
+        self.try_connection()
+        start = time.time()
+        p = subprocess.run(command, shell=True, cwd=self.workdir,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout = p.stdout.decode('utf-8')
+        stderr = p.stderr.decode('utf-8')
+        metrics.observe('ssh_command_seconds', time.time() - start, COMMAND_BUCKETS, host=self.host)
+        if stderr:
+            error = f'{self.host}: {stderr}'.strip()
+            logging.error(error)
+            print(f"[ERROR] {error}")
+        return stdout, stderr
+
+    def link(self, src, dst):
+        if os.path.abspath(src) == os.path.abspath(dst):
+            return
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def copy_file_to_workdir(self, local, remote):
+        self.try_connection()
+        self.link(local, f"{self.workdir}/{remote}")
+
+    def copy_file_from_workdir(self, remote, local):
+        self.try_connection()
+        self.link(f"{self.workdir}/{remote}", local)
+
+    def is_file_exist(self, remote):
+        return os.path.exists(f"{self.workdir}/{remote}")
+
+    def open_stream(self, command):
+        self.try_connection()
+        p = subprocess.Popen(command, shell=True, cwd=self.workdir, text=True,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        return p.stdin, p.stdout
+
+
+def create_server(s: dict) -> Server:
+    """
+    Create a server from an entry of servers.json.
+    """
+    workers = s.get('workers', 1)
+    workers = 1 if workers == 'auto' else workers
+    kwargs = {
+        'workers': workers,
+        'weight': s.get('weight', 1),
+        'runner': s.get('runner', 'docker'),
+    }
+    if s.get('backend', 'ssh') == 'local':
+        # the host only names the machine in the fleet, logs and metrics
+        return LocalServer(s['workdir'], host=s.get('host', 'localhost'), **kwargs)
+    return Server(s['host'], s['port'], s['username'], s['password'], s['workdir'], **kwargs)
@@ -2,7 +2,6 @@ import re
 import os
 import json
 import hashlib
-from bs4 import BeautifulSoup
 from typing import Generator, List, Tuple
 
 from .log import logging
@@ -233,11 +232,13 @@ class LemmaTraverser(object):
         return data
 
 
-def tamarin_command(i: str, o: str, tamarin='tamarin-prover', lemmas=[]):
+def tamarin_command(i: str, o: str, tamarin='tamarin-prover', lemmas=[], threads=6, rts_stats=False):
     # tamarin-prover --stop-on-trace=SEQDFS --prove=ASConsistency_UserNotReusePasskey_UserNotUseGuessablePasskey_UserNotConfusePENC --derivcheck-timeout=0 --quiet ./cases/BLE-SC_I[KeyboardDisplay_NoOOB_AuthReq_KeyHigh]_R[KeyboardDisplay_NoOOB_AuthReq_KeyHigh].spthy --output=./cases/ASConsistency.spthy
     lemma_opt = ' '.join([f'--prove={l}' for l in lemmas])
     cmd = 'export LC_ALL=C.UTF-8'
-    cmd += f' && {tamarin} +RTS -N6 -RTS --stop-on-trace=SEQDFS --derivcheck-timeout=0'
+    # GHC runtime statistics (GC, memory) are written to {o}.rts
+    rts = f' -s{o}.rts' if rts_stats else ''
+    cmd += f' && {tamarin} +RTS -N{threads}{rts} -RTS --stop-on-trace=SEQDFS --derivcheck-timeout=0'
     cmd += f' {i} {lemma_opt} --output={o} > {o}.tmp'
     cmd += f' && echo "" >> {o} && cat {o}.tmp >> {o} && rm {o}.tmp'
     return cmd
@@ -250,6 +251,7 @@ def lemmas_hash(lemmas: List[str]) -> str:
 
 
 def parse_theory_link(html: str, file: str):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     trs = soup.find_all('tr')
     for tr in trs:
@@ -261,6 +263,7 @@ def parse_theory_link(html: str, file: str):
 
 
 def parse_trace_links(html: str):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     trace_spans = soup.find_all('span', text='// trace found')
     trace_links = [s.parent['href'] for s in trace_spans]
@@ -268,6 +271,7 @@ def parse_trace_links(html: str):
 
 
 def parse_img_link(html: str):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     img = soup.find('img')
     if img is None:
@@ -302,3 +306,59 @@ def parse_hardware_info(text: str):
 
 def parse_time_info(text: str):
     return re.findall(r'processing time: (.+)', text)[0].strip()
+
+
+def parse_seconds(text: str) -> float:
+    # "264.90s" -> 264.9
+    return float(text.strip().rstrip('s'))
+
+
+def parse_rts_stats(text: str):
+    # output of +RTS -s
+    def number(pattern):
+        m = re.findall(pattern, text)
+        return int(m[0].replace(',', '')) if m else None
+
+    def seconds(pattern):
+        m = re.findall(pattern, text)
+        return float(m[0]) if m else None
+
+    return {
+        "allocated": number(r'([\d,]+) bytes allocated in the heap'),
+        "max residency": number(r'([\d,]+) bytes maximum residency'),
+        "total memory": number(r'([\d,]+) MiB total memory in use'),
+        "gc time": seconds(r'GC\s+time\s+([\d.]+)s'),
+        "total time": seconds(r'Total\s+time\s+([\d.]+)s'),
+        "elapsed": seconds(r'Total\s+time\s+[\d.]+s\s+\(\s*([\d.]+)s elapsed\)'),
+    }
+
+
+def parse_samples(text: str):
+    # output of files/sampler.py, one JSON object per line
+    samples = [json.loads(l) for l in text.split('\n') if l.strip()]
+    if len(samples) == 0:
+        return None
+    cpu = [s['cpu'] for s in samples]
+    rss = [s['rss'] for s in samples]
+    return {
+        "samples": len(samples),
+        "cpu mean": round(sum(cpu) / len(cpu), 2),
+        "cpu max": max(cpu),
+        "rss mean": round(sum(rss) / len(rss), 1),
+        "rss peak": max(rss),
+    }
+
+
+def resource_info(result: str):
+    """
+    Resource usage of the job of a result file, from the samples and the GHC
+    statistics stored next to it.
+    """
+    info = {}
+    if os.path.exists(f'{result}.samples'):
+        with open(f'{result}.samples', 'r', encoding='utf8') as f:
+            info.update(parse_samples(f.read()) or {})
+    if os.path.exists(f'{result}.rts'):
+        with open(f'{result}.rts', 'r', encoding='utf8') as f:
+            info.update(parse_rts_stats(f.read()))
+    return info if info else None
@@ -0,0 +1,125 @@
+import os
+import json
+from typing import Dict, List, Tuple
+
+from .log import logging
+
+CALIBRATION_CONF = 'calibration.json'
+DEFAULT_THREADS = 6
+# prefer fewer threads if they are at most 5% slower than the fastest setting
+TOLERANCE = 0.05
+
+
+def thread_steps(cores: int, full=False) -> List[int]:
+    """
+    Values of -N to benchmark on a host with the given number of cores.
+    Without full, only powers of two (and the core count itself) are used.
+    """
+    if full:
+        return list(range(1, cores + 1))
+    steps = []
+    n = 1
+    while n < cores:
+        steps.append(n)
+        n *= 2
+    steps.append(cores)
+    return steps
+
+
+def load_calibration(path=CALIBRATION_CONF) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf8') as f:
+        data = json.load(f)
+    # json keys are always strings
+    for host in data.values():
+        host['lemmas'] = {
+            lemma: {int(n): t for n, t in curve.items()}
+            for lemma, curve in host['lemmas'].items()
+        }
+    return data
+
+
+def save_calibration(data: dict, path=CALIBRATION_CONF):
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump(data, f, indent=4)
+
+
+def host_curve(lemma_curves: Dict[str, Dict[int, float]]) -> Dict[int, float]:
+    """
+    Sum the per-lemma curves to one curve, keeping only the values of -N
+    that were measured for every lemma.
+    """
+    curves = list(lemma_curves.values())
+    if len(curves) == 0:
+        return {}
+    steps = set(curves[0])
+    for curve in curves[1:]:
+        steps &= set(curve)
+    return {n: sum(curve[n] for curve in curves) for n in sorted(steps)}
+
+
+def best_threads(curve: Dict[int, float], budget: int) -> int:
+    candidates = {n: t for n, t in curve.items() if n <= budget}
+    if len(candidates) == 0:
+        return max(1, budget)
+    fastest = min(candidates.values())
+    for n in sorted(candidates):
+        if candidates[n] <= fastest * (1 + TOLERANCE):
+            return n
+
+
+def best_placement(curve: Dict[int, float], cores: int) -> Tuple[int, int]:
+    """
+    Choose the number of containers and -N for a host, so that the lemma
+    throughput (cores // N containers, each finishing a lemma every t(N)
+    seconds) is maximized.
+    """
+    best = None
+    for n, t in curve.items():
+        if n > cores or t <= 0:
+            continue
+        workers = cores // n
+        throughput = workers / t
+        if best is None or throughput > best[0]:
+            best = (throughput, workers, n)
+    if best is None:
+        return 1, DEFAULT_THREADS
+    return best[1], best[2]
+
+
+def apply_calibration(server, calibration: dict, auto_workers: bool):
+    """
+    Set workers, threads and the lemma curves of a server from its
+    calibration entry.
+    """
+    entry = calibration.get(server.host)
+    if entry is None:
+        if auto_workers:
+            logging.warning(f'No calibration found for {server.host}, using 1 worker.')
+            server.workers = 1
+        return
+
+    server.cores = entry['cores']
+    server.curves = entry['lemmas']
+    curve = host_curve(server.curves)
+    if auto_workers:
+        server.workers, server.threads = best_placement(curve, server.cores)
+    else:
+        server.threads = best_threads(curve, server.cores // server.workers)
+    logging.info(f'{server.host}: {server.workers} workers with -N{server.threads}')
+
+
+def lemma_threads(server, lemma: str) -> int:
+    """
+    -N for one lemma job. Lemmas without a calibrated curve use the curve of
+    the calibrated lemma with the longest matching prefix, and fall back to the
+    host default.
+    """
+    if not server.curves:
+        return server.threads
+    matches = [l for l in server.curves if lemma.startswith(l)]
+    if len(matches) == 0:
+        return server.threads
+    curve = server.curves[max(matches, key=len)]
+    return best_threads(curve, server.cores // server.workers)
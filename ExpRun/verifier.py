@@ -2,42 +2,71 @@ import os
 import time
 import json
 import shutil
+import hashlib
 import threading
 from typing import List
-from reprint import output
 from argparse import ArgumentParser
 
 from utils.log import logging
 from utils.cases import case_sort
-from utils.server import Server
-from utils.tamarin import LemmaTraverser, tamarin_command, lemmas_hash, parse_lemma_results, parse_time_info
-from utils.docker import load_image, is_container_exist, IMAGE_NAME, IMAGE_VERSION
+from utils.server import Server, create_server
+from utils.tamarin import LemmaTraverser, tamarin_command, lemmas_hash, parse_lemma_results, parse_time_info, parse_seconds, parse_hardware_info
+from utils.docker import load_image
+from utils.backend import create_backend, heartbeat_command, sampler_command, STORE_DIR
+from utils.tuning import load_calibration, apply_calibration, lemma_threads, host_curve
+from utils.fleet import Fleet
+from utils.metrics import metrics, PROOF_BUCKETS, STARTUP_BUCKETS
+from utils.interactive import InteractiveQueue, Preempted, JOBS_PORT, serve as serve_jobs
 
 CASES_DIR = './cases'
 CONTAINER_NAME = 'tamarin_ble_verify'
 OUTPUT_DIR = "./results"
+# outside of the results, which hold one directory per case
+INTERACTIVE_DIR = "./interactive"
 
 LEMMAS_CONF = 'lemmas.json'
 SERVER_CONF = 'servers.json'
 RUNNING_CONF = "running.json"
+METRICS_PORT = 9464
 
 CHECK_TIME = 10
+# jobs touch their heartbeat file every HEARTBEAT_TIME seconds, and a job whose
+# heartbeat was not seen for LEASE_TIME seconds is stopped and started again
+HEARTBEAT_TIME = 30
+LEASE_TIME = 300
+# interval of the CPU and memory samples of a job
+SAMPLE_TIME = 10
+# failed models are retried on the same slot first, to reattach their jobs
+JOB_RETRY = 3
+# servers.json is reloaded and failed hosts are retried every RELOAD_TIME seconds
+RELOAD_TIME = 60
+# an interactive job that found no free slot for PREEMPT_TIME seconds stops the
+# most recently started bulk job, which is started again after it
+PREEMPT_TIME = 60
 
 server_case_map = {}
+# files already in the model store of every host
+staged_files = {}
 global_lock = threading.Lock()
+fleet = Fleet()
+interactive = InteractiveQueue()
+# hosts being connected, every host starts verifying as soon as it is ready
+admitting = set()
+launch_time = time.time()
+first_job = threading.Event()
 
 class FilePool():
     def __init__(self, files: list) -> None:
         self.files = files
+        # running cases of the last run, kept for their slots until their host is admitted
+        self.held = []
         self.total = len(files)
         self.progress = 0
         self.lock = threading.Lock()
 
     def pop(self):
-        if len(self.files) == 0:
-            return None
         self.lock.acquire()
-        file = self.files.pop(0)
+        file = self.files.pop(0) if len(self.files) > 0 else None
         self.lock.release()
         return file
 
@@ -51,6 +80,30 @@ class FilePool():
         self.files.remove(file)
         self.lock.release()
 
+    def take(self, file: str) -> bool:
+        self.lock.acquire()
+        found = file in self.files or file in self.held
+        if file in self.files:
+            self.files.remove(file)
+        elif file in self.held:
+            self.held.remove(file)
+        self.lock.release()
+        return found
+
+    def hold(self, file: str):
+        self.lock.acquire()
+        if file in self.files:
+            self.files.remove(file)
+            self.held.append(file)
+        self.lock.release()
+
+    def release(self, file: str):
+        self.lock.acquire()
+        if file in self.held:
+            self.held.remove(file)
+            self.files.append(file)
+        self.lock.release()
+
     def update(self, num: int):
         self.lock.acquire()
         self.progress += num
@@ -76,20 +129,30 @@ class Verifier():
         self.num = num
         self.outdir = outdir
         self.server = server
+        self.backend = create_backend(server)
         self.finish_cnt = 0
         self.current_file = ""
         self.current_progress = ""
+        self.model_file = None
+        self.last_job_end = None
+        self.job_start = None
+        self.interactive = False
+        self.preempt = threading.Event()
         self.container_workdir = f"{num}"
         self.container_name = f"{CONTAINER_NAME}_{num}"
         self.container_hostname = f"{self.server.host}_{num}".replace('.', '_')
 
-    def create(self):
-        self.server.excute(
-            f'[ -d {self.container_workdir} ] && rm -rf {self.container_workdir}')
-        self.server.excute(f'mkdir -p {self.container_workdir}/cases')
-        self.server.excute(f'mkdir -p {self.container_workdir}/proofs')
+    def create(self, force: bool = False):
+        # keep the slot of a previous run, its jobs and results are reattached
+        if force:
+            self.server.excute(
+                f'[ -d {self.container_workdir} ] && rm -rf {self.container_workdir}')
+        # models are read from the store of the host, slots only hold outputs
+        self.server.excute(f'mkdir -p {STORE_DIR} {self.container_workdir}/proofs')
         self.server.copy_file_to_workdir(
             'files/hardware.py', f'{self.container_workdir}/hardware.py')
+        self.server.copy_file_to_workdir(
+            'files/sampler.py', f'{self.container_workdir}/sampler.py')
 
     def process_result(self, lemmas: List[str], result: str) -> List[bool]:
         with open(result, 'r', encoding='utf8') as f:
@@ -108,17 +171,27 @@ class Verifier():
                 raise Exception(f'Failed to find verfication result of {lemma}')
         return result, parse_time_info(result_content)
 
-    def verify_lemmas(self, modelfile: str, lemmas: List[str], outdir: str) -> List[bool]:
+    def verify_lemmas(self, modelfile: str, lemmas: List[str], outdir: str, fresh: bool = False) -> List[bool]:
         filename = modelfile.split('/')[-1]
         casename = filename.split('.')[0]
         lemmahash = lemmas_hash(lemmas)
-        remote_file = f"/work/cases/{filename}"
-        remote_result = f"/work/proofs/{casename}_{lemmahash}.spthy"
+        remote_file = self.model_file
+        # results are only reattached for the model they were proven from,
+        # the digest of the store file changes with the model and its tactics
+        digest = remote_file.split('/')[-1].split('.')[0]
+        remote_result = f"proofs/{casename}_{lemmahash}_{digest}.spthy"
+        if fresh:
+            # a fresh job never reattaches the jobs and results of the bulk run
+            remote_result = f"proofs/interactive_{casename}_{lemmahash}_{digest}.spthy"
         local_result = f"{outdir}/{lemmahash}.spthy"
+        local_digest = f"{local_result}.model"
 
         verified = False
-        if os.path.exists(local_result):
+        if not fresh and os.path.exists(local_result):
             try:
+                with open(local_digest, 'r', encoding='utf8') as f:
+                    if f.read() != digest:
+                        raise Exception(f'{local_result} was proven from another theory')
                 result, _ = self.process_result(lemmas, local_result)
                 logging.info(f'{casename}{lemmas} has been verified.')
                 verified = True
@@ -126,77 +199,209 @@ class Verifier():
                 pass
 
         if not verified:
-            logging.info(f'Verifying {casename}{lemmas} on {self.container_hostname}')
-
-            # verify hypothesis lemmas
-            cmd = tamarin_command(remote_file, remote_result, lemmas=lemmas)
-            # get hardware information
-            cmd += f" && python3 /work/hardware.py >> {remote_result}"
-
-            docker = f'docker run -d --rm --name {self.container_name}'
-            docker += f' -v {self.server.workdir}/{self.container_workdir}:/work'
-            docker += f' -w /work'
-            docker += f' -e CONTAIN_HNAME={self.container_hostname}'
-            docker += f' {IMAGE_NAME}:{IMAGE_VERSION} bash -c "{cmd}"'
-            self.server.excute(docker)
+            slot_result = f"{self.container_workdir}/{remote_result}"
+            heartbeat = f"{remote_result}.hb"
+            slot_heartbeat = f"{self.container_workdir}/{heartbeat}"
+
+            labels = {'host': self.server.host, 'slot': self.num}
+            # the running job of the slot may prove another theory, only its heartbeat tells
+            if not fresh and self.backend.is_running(self.container_name) and \
+                    self.backend.lease_alive(self.container_name, slot_heartbeat, LEASE_TIME) and \
+                    self.server.is_file_exist(slot_heartbeat):
+                # the job outlived a failure of the controller or of the connection
+                logging.info(f'Reattaching {casename}{lemmas} on {self.container_hostname}')
+                metrics.event('job_reattach', case=casename, lemmas=lemmas, **labels)
+            elif not fresh and self.server.is_file_exist(slot_result):
+                logging.info(f'Reattaching result of {casename}{lemmas} on {self.container_hostname}')
+                metrics.event('result_reattach', case=casename, lemmas=lemmas, **labels)
+            else:
+                if self.backend.is_running(self.container_name):
+                    self.stop_verify()
+                if fresh:
+                    self.server.excute(f'rm -f {slot_result} {slot_result}.samples {slot_result}.rts')
+                logging.info(f'Verifying {casename}{lemmas} on {self.container_hostname}')
+
+                # verify hypothesis lemmas
+                threads = max(lemma_threads(self.server, l) for l in lemmas)
+                cmd = tamarin_command(remote_file, remote_result, lemmas=lemmas,
+                                      threads=threads, rts_stats=True)
+                # get hardware information
+                cmd += f" && python3 hardware.py >> {remote_result}"
+                cmd = sampler_command(cmd, f"{remote_result}.samples", SAMPLE_TIME)
+                cmd = heartbeat_command(cmd, heartbeat, HEARTBEAT_TIME)
+
+                if self.last_job_end is not None:
+                    metrics.inc('slot_idle_seconds_total', time.time() - self.last_job_end, **labels)
+                outputs = [remote_result, f"{remote_result}.samples", f"{remote_result}.rts"]
+                self.backend.run(self.container_name, self.container_workdir,
+                                 cmd, hostname=self.container_hostname, outputs=outputs)
+                metrics.event('job_start', case=casename, lemmas=lemmas, threads=threads, **labels)
+                if not first_job.is_set():
+                    first_job.set()
+                    seconds = round(time.time() - launch_time, 1)
+                    metrics.set('first_job_seconds', seconds)
+                    logging.info(f'First job started {seconds}s after launch')
 
             # wait
-            while is_container_exist(self.server, self.container_name):
-                time.sleep(CHECK_TIME)
+            metrics.set('lemmas_in_flight', len(lemmas), **labels)
+            self.job_start = time.time()
+            try:
+                self.wait_job(slot_heartbeat)
+            finally:
+                metrics.set('lemmas_in_flight', 0, **labels)
+                self.last_job_end = time.time()
+                self.job_start = None
             # get results
-            remote_result = self.container_workdir + \
-                f"/proofs/{casename}_{lemmahash}.spthy"
-            self.server.copy_file_from_workdir(remote_result, local_result)
+            if not self.backend.collect(slot_result, local_result):
+                raise Exception(f'Failed to find the result of {casename}{lemmas}')
+            # results of older runs have no samples
+            for ext in ['samples', 'rts']:
+                self.backend.collect(f'{slot_result}.{ext}', f'{local_result}.{ext}')
 
-            result, time_used = self.process_result(lemmas, local_result)
+            try:
+                result, time_used = self.process_result(lemmas, local_result)
+            except:
+                # an incomplete result must not be reattached again
+                self.server.excute(f'rm -f {slot_result}')
+                os.remove(local_result)
+                raise
+            with open(local_digest, 'w', encoding='utf8') as f:
+                f.write(digest)
             logging.info(f'Verified {casename}{lemmas} using {time_used}.')
+            fleet.record(self.server.host, casename, ','.join(lemmas), parse_seconds(time_used),
+                         self.hardware_info(local_result))
+            metrics.observe('lemma_seconds', parse_seconds(time_used), PROOF_BUCKETS, **labels)
+            metrics.event('job_end', case=casename, lemmas=lemmas, result=result,
+                          seconds=parse_seconds(time_used), **labels)
 
         return result
 
-    def restore_verify_lemmas(self, modelfile: str, lemmas: List[str], outdir: str) -> List[bool]:
-        filename = modelfile.split('/')[-1]
-        casename = filename.split('.')[0]
-        lemmahash = lemmas_hash(lemmas)
-        remote_result = f"/work/proofs/{casename}_{lemmahash}.spthy"
-        local_result = f"{outdir}/{lemmahash}.spthy"
-        
-        verified = False
-        if os.path.exists(local_result):
+    def wait_job(self, heartbeat: str):
+        """
+        Wait for the job of this slot to finish. Errors of the connection do
+        not stop the job, it is only stopped once no heartbeat has been seen
+        for LEASE_TIME seconds.
+        """
+        last_seen = time.time()
+        while True:
+            if self.preempt.is_set() and not self.interactive:
+                self.stop_verify()
+                metrics.event('job_preempted', host=self.server.host, slot=self.num)
+                raise Preempted(f'Job on {self.container_hostname} preempted')
             try:
-                result, _ = self.process_result(lemmas, local_result)
-                logging.info(f'{casename}{lemmas} has been verified.')
-                verified = True
-            except:
-                pass
-            
-        if not verified:
-            logging.info(f'Restore verifying {casename}{lemmas} on {self.container_hostname}')
+                if not self.backend.is_running(self.container_name):
+                    return
+                if self.backend.lease_alive(self.container_name, heartbeat, LEASE_TIME):
+                    last_seen = time.time()
+            except Exception as e:
+                logging.warning(f'Failed to check the job on {self.container_hostname}: {e}')
+            if time.time() - last_seen > LEASE_TIME:
+                try:
+                    self.stop_verify()
+                except:
+                    pass
+                metrics.event('lease_expired', host=self.server.host, slot=self.num)
+                raise Exception(f'Lease of the job on {self.container_hostname} expired')
+            time.sleep(CHECK_TIME)
 
-            # wait
-            while is_container_exist(self.server, self.container_name):
-                time.sleep(CHECK_TIME)
-            # get results
-            remote_result = self.container_workdir + \
-                f"/proofs/{casename}_{lemmahash}.spthy"
-            self.server.copy_file_from_workdir(remote_result, local_result)
+    def verify_bulk(self, modelfile: str, lemmas: List[str], outdir: str) -> List[bool]:
+        # waiting interactive jobs run first, a preempted job is started again
+        while True:
+            self.run_interactive()
+            try:
+                return self.verify_lemmas(modelfile, lemmas, outdir)
+            except Preempted:
+                logging.info(f'Preempted {lemmas} on {self.container_hostname}')
+
+    def run_interactive(self):
+        """
+        Run the waiting interactive jobs on this slot. The model this slot is
+        verifying continues with its next lemma afterwards.
+        """
+        self.preempt.clear()
+        state = (self.current_file, self.current_progress, self.model_file)
+        self.interactive = True
+        try:
+            while True:
+                job = interactive.pop()
+                if job is None:
+                    break
+                self.run_interactive_job(job)
+        finally:
+            self.interactive = False
+            self.current_file, self.current_progress, self.model_file = state
+
+    def run_interactive_job(self, job: dict):
+        labels = {'host': self.server.host, 'slot': self.num}
+        lemmas = list(job['lemmas'])
+        outdir = f"{INTERACTIVE_DIR}/{job['case']}"
+        os.makedirs(outdir, exist_ok=True)
+        self.current_file = f"{job['case']} (interactive {job['id']})"
+        self.current_progress = ','.join(lemmas)
+        metrics.event('interactive_start', id=job['id'], case=job['case'], lemmas=lemmas,
+                      wait=round(job['started'] - job['submitted'], 1), **labels)
+        try:
+            # the model is read again, it may have changed since the run started
+            self.model_file = self.stage_file(job['model'])
+            result = self.verify_lemmas(job['model'], lemmas, outdir, fresh=True)
+            local_result = f"{outdir}/{lemmas_hash(lemmas)}.spthy"
+            _, time_used = self.process_result(lemmas, local_result)
+        except Exception as e:
+            if not self.server.is_connected():
+                interactive.push(job)
+                raise
+            logging.error(f"Failed interactive job {job['id']} on {self.container_hostname}: {e}")
+            interactive.finish(job, error=str(e))
+            return
+        interactive.finish(job, {
+            'result': {l: 'verified' if r else 'falsified' for l, r in zip(lemmas, result)},
+            'seconds': parse_seconds(time_used),
+            'file': local_result,
+            'host': self.server.host,
+        })
+        metrics.event('interactive_end', id=job['id'], case=job['case'], lemmas=lemmas,
+                      result=result, seconds=parse_seconds(time_used), **labels)
+
+    def hardware_info(self, result: str) -> dict:
+        try:
+            with open(result, 'r', encoding='utf8') as f:
+                return parse_hardware_info(f.read())
+        except:
+            return None
 
-            result, time_used = self.process_result(lemmas, local_result)
-            logging.info(f'Verified {casename}{lemmas} using {time_used}.')
+    def stage_file(self, local: str) -> str:
+        """
+        Upload a file to the content addressed store of the host, once for all
+        slots, and return its path for the jobs.
+        """
+        with open(local, 'rb') as f:
+            filename = f'{hashlib.md5(f.read()).hexdigest()}.spthy'
+        global_lock.acquire()
+        staged = staged_files.setdefault(self.server.host, set())
+        found = filename in staged
+        global_lock.release()
 
-        return result
-    
-    def verify(self, modelfile: str, restore_lemmas: List[str] = []):
+        if not found and not self.server.is_file_exist(f'{STORE_DIR}/{filename}'):
+            # slots of the same host may stage the same file at the same time
+            tmp = f'{STORE_DIR}/{filename}.{self.num}'
+            self.server.copy_file_to_workdir(local, tmp)
+            self.server.excute(f'mv {tmp} {STORE_DIR}/{filename}')
+        global_lock.acquire()
+        staged.add(filename)
+        global_lock.release()
+        return self.backend.store_path(filename)
+
+    def verify(self, modelfile: str):
         filename = modelfile.split('/')[-1]
         self.current_file = filename
-        remote_file = f"{self.container_workdir}/cases/{filename}"
-        self.server.copy_file_to_workdir(modelfile, remote_file)
+        self.model_file = self.stage_file(modelfile)
 
         outdir = f"{self.outdir}/{filename.split('.')[0]}"
         os.makedirs(outdir, exist_ok=True)
 
         traverser = LemmaTraverser(modelfile, LEMMAS_CONF)
         self.current_progress = f'{traverser.finished}/{traverser.total}'
-        hypothesis_result = self.verify_lemmas(
+        hypothesis_result = self.verify_bulk(
             modelfile, traverser.hypothesis, outdir)
         if False in hypothesis_result:
             logging.error(
@@ -214,12 +419,7 @@ class Verifier():
                     json.dump(server_case_map, f)
                 global_lock.release()
                 
-                if [l] == restore_lemmas:
-                    r = self.restore_verify_lemmas(modelfile, [l], outdir)
-                else:
-                    r = self.verify_lemmas(modelfile, [l], outdir)
-                    pass
-                    
+                r = self.verify_bulk(modelfile, [l], outdir)
                 traverser.mark_lemmas([l], r)
         global_lock.acquire()
         server_case_map.pop(self.container_hostname)
@@ -239,7 +439,24 @@ class Verifier():
             json.dump(lemmas_result, f, indent=4)
 
     def stop_verify(self):
-        self.server.excute(f'docker rm -f {self.container_name}')
+        self.backend.stop(self.container_name)
+
+    def next_file(self, filepool: FilePool):
+        # in the tail of the run, leave the last cases to the faster hosts,
+        # the slot stays while interactive jobs wait after the pool is empty
+        while (len(filepool.files) > 0 or interactive.waiting() > 0) \
+                and not fleet.is_leaving(self.server.host):
+            try:
+                self.run_interactive()
+            except:
+                fleet.fail(self.server.host)
+                return None
+            if len(filepool.files) > 0 and fleet.may_take(self.server.host, len(filepool.files)):
+                file = filepool.pop()
+                if file is not None:
+                    return file
+            time.sleep(CHECK_TIME)
+        return None
 
     def verify_loop(self, filepool: FilePool, running: list):
         running_file_lemma = None
@@ -247,37 +464,203 @@ class Verifier():
             if self.container_hostname == r:
                 running_file_lemma = running[r]
                 break
-            
-        while True:
-            if running_file_lemma is None:
-                file = filepool.pop()
-                restore_lemmas = []
-            else:
-                file = running_file_lemma[0]
-                restore_lemmas = [running_file_lemma[1]]
-                running_file_lemma = None
-                
-            if file is None:
-                break
-            
-            try:
-                self.verify(file, restore_lemmas=restore_lemmas)
-                fin = f'Finished verifying {file} on '
-                fin += f'{self.server.host}[container_{self.num}]'
-                logging.info(fin)
-                filepool.update(1)
-                self.finish_cnt += 1
-            except Exception as e:
-                if isinstance(e, KeyboardInterrupt):
+
+        fleet.join(self.server.host)
+        file = None
+        retry = 0
+        try:
+            while True:
+                if running_file_lemma is not None:
+                    # reattach the job of the last run
+                    file = running_file_lemma[0]
+                    running_file_lemma = None
+                elif file is None:
+                    file = self.next_file(filepool)
+                    retry = 0
+
+                if file is None:
                     break
-                error = f'Failed to verify {file} on '
-                error += f'{self.server.host}[container_{self.num}]: '
-                error += str(e)
-                logging.error(error)
-                filepool.push(file)
 
-                if is_container_exist(self.server, self.container_name):
-                    self.stop_verify()
+                try:
+                    self.verify(file)
+                    fin = f'Finished verifying {file} on '
+                    fin += f'{self.server.host}[container_{self.num}]'
+                    logging.info(fin)
+                    filepool.update(1)
+                    self.finish_cnt += 1
+                    metrics.inc('cases_finished_total', host=self.server.host, slot=self.num)
+                    metrics.event('case_end', case=file, host=self.server.host, slot=self.num)
+                    file = None
+                except Exception as e:
+                    if isinstance(e, KeyboardInterrupt):
+                        break
+                    error = f'Failed to verify {file} on '
+                    error += f'{self.server.host}[container_{self.num}]: '
+                    error += str(e)
+                    logging.error(error)
+                    metrics.inc('job_failures_total', host=self.server.host, slot=self.num)
+                    metrics.event('case_failed', case=file, host=self.server.host, slot=self.num,
+                                  error=str(e))
+
+                    # the host is gone, it is re-admitted once it comes back
+                    # and reattaches the jobs that are still running
+                    if not self.server.is_connected():
+                        filepool.push(file)
+                        fleet.fail(self.server.host)
+                        break
+                    # retry on this slot, the finished lemmas and the running
+                    # job are reattached instead of starting the model again
+                    retry += 1
+                    if retry >= JOB_RETRY:
+                        filepool.push(file)
+                        file = None
+        finally:
+            fleet.leave(self.server.host)
+
+
+def preempt_slots(verifiers: List[Verifier]):
+    """
+    Preempt the most recently started bulk jobs, which lose the least work, for
+    the interactive jobs that have waited PREEMPT_TIME seconds.
+    """
+    busy = [v for v in verifiers if v.job_start is not None and not v.interactive
+            and not fleet.is_leaving(v.server.host)]
+    wanted = interactive.waiting(PREEMPT_TIME) - len([v for v in busy if v.preempt.is_set()])
+    busy = sorted([v for v in busy if not v.preempt.is_set()], key=lambda v: v.job_start, reverse=True)
+    for v in busy[:max(wanted, 0)]:
+        logging.info(f'Preempting {v.current_file} on {v.container_hostname}')
+        v.preempt.set()
+
+
+def connect_server(s: dict, calibration: dict) -> Server:
+    server = create_server(s)
+    apply_calibration(server, calibration, s['workers'] == 'auto')
+    server.try_connection()
+    return server
+
+
+def start_verifier(verifier: Verifier, filepool: FilePool, running: list):
+    t = threading.Thread(target=verifier.verify_loop, args=(filepool, running, ))
+    t.start()
+    return verifier, t
+
+
+def stop_host(s: dict, calibration: dict):
+    try:
+        server = connect_server(s, calibration)
+    except:
+        logging.error(f"Failed to connect to {s['host']}")
+        return
+    for i in range(server.workers):
+        print(f'Stopping verify on {server.host}[container_{i}]')
+        Verifier(server, i, OUTPUT_DIR).stop_verify()
+
+
+def release_cases(host: str, filepool: FilePool, first: int = 0):
+    # the cases the slots of a host from the first one on were running go back to the pool
+    prefix = f'{host}_'.replace('.', '_')
+    global_lock.acquire()
+    files = [entry[0] for name, entry in server_case_map.items()
+             if name.startswith(prefix) and name[len(prefix):].isdigit()
+             and int(name[len(prefix):]) >= first]
+    global_lock.release()
+    for file in files:
+        filepool.release(file)
+
+
+def release_unwanted(hosts: list, filepool: FilePool):
+    # the held cases of slots that none of the hosts will resume go back to the pool
+    prefixes = [f'{host}_'.replace('.', '_') for host in hosts]
+    global_lock.acquire()
+    files = [entry[0] for name, entry in server_case_map.items()
+             if not any(name.startswith(p) and name[len(p):].isdigit() for p in prefixes)]
+    global_lock.release()
+    for file in files:
+        filepool.release(file)
+
+
+def admit_host(s: dict, calibration: dict, workers: dict, filepool: FilePool, force: bool = False):
+    """
+    Connect to a host in the background and start its slots once it is ready,
+    so slow or unreachable hosts do not delay the others.
+    """
+    global_lock.acquire()
+    found = s['host'] in admitting
+    admitting.add(s['host'])
+    global_lock.release()
+    if not found:
+        threading.Thread(target=start_host, daemon=True,
+                         args=(s, calibration, workers, filepool, force)).start()
+
+
+def start_host(s: dict, calibration: dict, workers: dict, filepool: FilePool, force: bool = False):
+    host = s['host']
+    weight = s.get('weight', 1)
+    start = time.time()
+    try:
+        server = connect_server(s, calibration)
+        if server.runner != 'process':
+            load_image(server, force)
+        if force:
+            server.excute(f'rm -rf {STORE_DIR}')
+        verifiers = [Verifier(server, i, OUTPUT_DIR) for i in range(server.workers)]
+        for verifier in verifiers:
+            verifier.create(force)
+    except Exception as e:
+        logging.error(f'Failed to admit {host}: {e}')
+        fleet.add(host, weight)
+        fleet.fail(host)
+        release_cases(host, filepool)
+        global_lock.acquire()
+        admitting.discard(host)
+        global_lock.release()
+        return
+
+    fleet.add(host, weight)
+    fleet.calibrate(host, host_curve(server.curves).get(server.threads))
+    host_workers = []
+    for verifier in verifiers:
+        # resume the model of this slot, unless another slot has taken it
+        running = {}
+        global_lock.acquire()
+        entry = server_case_map.get(verifier.container_hostname)
+        global_lock.release()
+        if entry is not None and filepool.take(entry[0]):
+            running[verifier.container_hostname] = entry
+        host_workers.append(start_verifier(verifier, filepool, running))
+    # the host may have fewer slots than in the last run
+    release_cases(host, filepool, server.workers)
+    global_lock.acquire()
+    workers[host] = host_workers
+    admitting.discard(host)
+    global_lock.release()
+
+    seconds = time.time() - start
+    metrics.observe('host_startup_seconds', seconds, STARTUP_BUCKETS, host=host)
+    logging.info(f'Admitted {host} with {server.workers} workers in {round(seconds, 1)}s')
+    metrics.event('host_admitted', host=host, workers=server.workers, seconds=round(seconds, 1))
+
+
+def sync_fleet(servers_data: list, calibration: dict, workers: dict, filepool: FilePool):
+    """
+    Drain the hosts removed from servers.json or marked with "drain", and admit
+    new hosts as well as hosts that failed or were drained before.
+    """
+    wanted = {s['host']: s for s in servers_data if not s.get('drain', False)}
+    for host in list(workers):
+        if host not in wanted:
+            fleet.drain(host)
+    release_unwanted(list(wanted), filepool)
+
+    for host, s in wanted.items():
+        weight = s.get('weight', 1)
+        if any(t.is_alive() for _, t in workers.get(host, [])):
+            if not fleet.hosts[host].failed:
+                fleet.add(host, weight)
+            continue
+        if len(filepool.files) == 0:
+            continue
+        admit_host(s, calibration, workers, filepool)
 
 
 def main():
@@ -287,46 +670,28 @@ def main():
     parser.add_argument('-s', action='store_true', help='force stop verify')
     parser.add_argument('-f', action='store_true',
                         help='force distribute and load image')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='port of the /metrics endpoint, 0 to disable')
+    parser.add_argument('--jobs-port', type=int, default=JOBS_PORT,
+                        help='local port accepting interactive jobs, 0 to disable')
     args = parser.parse_args()
     stop = args.s
     force = args.f
 
-    # load servers and verifier
     with open(SERVER_CONF, 'r')as f:
         servers_data = json.load(f)
-    servers = []
-    verifiers = []
-    for s in servers_data:
-        try:
-            server = Server(
-                s['host'], s['port'], s['username'], s['password'], s['workdir'],
-                weight=s['weight'], workers=s['workers'])
-            server.try_connection()
-            servers.append(server)
-            for i in range(s['workers']):
-                verifier = Verifier(server, i, OUTPUT_DIR)
-                verifiers.append(verifier)
-        except:
-            err = f'Failed to create verifier '
-            err += f'container on {server.host}\n'
-            logging.error(err)
+    calibration = load_calibration()
+    wanted = [s for s in servers_data if not s.get('drain', False)]
 
     # if stop, stop all verifiers
     if stop:
-        for verifier in verifiers:
-            print(f'Stopping verify on ' +
-                  f'{verifier.server.host}[container_{verifier.num}]')
-            verifier.stop_verify()
+        threads = [threading.Thread(target=stop_host, args=(s, calibration)) for s in wanted]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
         return
 
-    # load docker image
-    for server in servers:
-        load_image(server, force)
-
-    # create verifier work env
-    for verifier in verifiers:
-        verifier.create()
-
     # create output dir
     if force and os.path.exists(OUTPUT_DIR):
         shutil.rmtree(OUTPUT_DIR)
@@ -337,7 +702,7 @@ def main():
         with open(RUNNING_CONF, 'r') as f:
             running = json.load(f)
     else:
-        running = []
+        running = {}
     
     # load cases
     files = os.listdir(CASES_DIR)
@@ -346,33 +711,75 @@ def main():
     cases = [f"{CASES_DIR}/{f}" for f in cases]
     cases_pool = FilePool(cases)
     
-    # remove running files
+    # hold running files for their slots
     for r in running:
-        cases_pool.remove(running[r][0])
+        cases_pool.hold(running[r][0])
+    server_case_map.update(running)
+    release_unwanted([s['host'] for s in wanted], cases_pool)
         
-    # start verify
-    threading_pool = []
-    for verifier in verifiers:
-        t = threading.Thread(target=verifier.verify_loop, args=(cases_pool, running, ))
-        t.start()
-        threading_pool.append(t)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        logging.info(f'Serving metrics on port {args.metrics_port}')
+    if args.jobs_port:
+        serve_jobs(interactive, args.jobs_port, CASES_DIR)
+        logging.info(f'Accepting interactive jobs on port {args.jobs_port}')
+
+    # connect to all hosts at once, load the image and create the slots of
+    # every host while the hosts that are ready already verify
+    workers = {}
+    for s in wanted:
+        fleet.add(s['host'], s.get('weight', 1))
+    for s in wanted:
+        admit_host(s, calibration, workers, cases_pool, force)
 
     def all_finished():
-        for t in threading_pool:
-            if t.is_alive():
-                return False
-        return True
-
-    with output(output_type="list", initial_len=1+len(verifiers), interval=0) as output_list:
+        if len(admitting) > 0:
+            return False
+        for host_workers in list(workers.values()):
+            for _, t in host_workers:
+                if t.is_alive():
+                    return False
+        # wait for failed hosts to come back while cases are left
+        wanted = [s for s in servers_data if not s.get('drain', False)]
+        return (len(cases_pool.files) == 0 and len(cases_pool.held) == 0) or len(wanted) == 0
+
+    from reprint import output
+    last_sync = time.time()
+    with output(output_type="list", initial_len=2, interval=0) as output_list:
         while not all_finished():
             time.sleep(1)
+            if time.time() - last_sync > RELOAD_TIME:
+                last_sync = time.time()
+                try:
+                    with open(SERVER_CONF, 'r') as f:
+                        servers_data = json.load(f)
+                except Exception as e:
+                    logging.error(f'Failed to reload {SERVER_CONF}: {e}')
+                sync_fleet(servers_data, calibration, workers, cases_pool)
+
+            preempt_slots([v for host_workers in list(workers.values())
+                           for v, t in host_workers if t.is_alive()])
+            metrics.set('queue_depth', len(cases_pool.files))
+            metrics.set('interactive_queue_depth', interactive.waiting())
             pbar = cases_pool.get_progress_bar()
-            for ind, verifier in enumerate(verifiers):
-                name = f'{verifier.server.host}[{verifier.num}]'
-                out = f"{name} ({verifier.finish_cnt} finished): "
-                out += f'{verifier.current_file}[{verifier.current_progress}]'
-                output_list[ind] = out
-            output_list[-1] = f'progress: {pbar}'
+            lines = []
+            for host, host_workers in list(workers.items()):
+                for verifier, t in host_workers:
+                    name = f'{verifier.server.host}[{verifier.num}]'
+                    out = f"{name} ({verifier.finish_cnt} finished): "
+                    out += f'{verifier.current_file}[{verifier.current_progress}]'
+                    if not t.is_alive():
+                        out += ' stopped'
+                    lines.append(out)
+            lines.append(f"hosts: {', '.join(fleet.summary(host) for host in list(workers))}")
+            lines.append(f'progress: {pbar}, {interactive.waiting()} interactive jobs waiting')
+            for ind, line in enumerate(lines):
+                if ind < len(output_list):
+                    output_list[ind] = line
+                else:
+                    output_list.append(line)
+    # no slot is left to run the jobs submitted from now on
+    interactive.close('The run has finished')
 
 
 if __name__ == "__main__":